@@ -0,0 +1 @@
+__doc__ = """Mesures de performance des pages de l'application sur des données synthétiques (voir benchmarks.run)"""
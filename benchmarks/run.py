@@ -0,0 +1,245 @@
+__doc__ = """Mesures de performance des pages, sans navigateur (streamlit.testing), sur des données synthétiques
+
+Pour chaque taille, les fichiers sont générés dans <workdir>/<taille>/data (voir benchmarks.synthetic) et préparés
+(voir enr_app.build), puis chaque
+page est lancée dans un processus séparé, avec les données locales (data/, sans $AWS_S3_ENDPOINT). Sont mesurés :
+la durée des imports de la page (et les bibliothèques géographiques importées), le démarrage à froid (chargement
+des données compris), la durée de chaque interaction, la médiane de plusieurs réexécutions sans changement et le
+pic de mémoire (RSS) du processus.
+
+Usage: python -m benchmarks.run [--scales 10000 100000 1000000] [--workdir /tmp/enr_bench] [--output bench.json]"""
+
+import argparse
+import ast
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+pages_dir = root / "enr_app"
+
+
+def get_pages():
+    """
+    Returns: dict {nom court: chemin} des pages de l'application (Accueil, Puissance...)
+    """
+    paths = sorted(pages_dir.glob("01_*.py")) + sorted(pages_dir.glob("pages/*.py"))
+    return {path.stem.split("_")[-1]: path for path in paths}
+
+
+# Bibliothèques lourdes que seule la page d'accueil devrait importer
+geo_modules = ["geopandas", "shapely", "pyproj", "folium", "s3fs"]
+
+
+def import_page(page):
+    """
+    Exécute seulement les imports de la page, dans le processus courant (à faire avant toute autre import)
+
+    Args:
+        page: str, nom court de la page
+
+    Returns: dict avec imports (s) et geo_modules (bibliothèques lourdes importées)
+    """
+    path = get_pages()[page]
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    imports = [x for x in tree.body if isinstance(x, (ast.Import, ast.ImportFrom))]
+    code = compile(ast.Module(imports, type_ignores=[]), str(path), "exec")
+    start = time.perf_counter()
+    exec(code, {})
+    return {
+        "imports": time.perf_counter() - start,
+        "geo_modules": [x for x in geo_modules if x in sys.modules],
+    }
+
+
+def select(key, value):
+    return lambda at: at.selectbox(key=key).select(value)
+
+
+def check(label, value=True):
+    def interaction(at):
+        checkbox = next(x for x in at.checkbox if x.label == label or x.key == label)
+        return checkbox.check() if value else checkbox.uncheck()
+
+    return interaction
+
+
+zone_interactions = [
+    ("region", select("region", "Grand Est")),
+    ("departement", select("departement", "Marne")),
+    ("epci", select("EPCI", "CC Marne 0")),
+    ("filiere", check("Eolien", False)),
+]
+
+# Interactions jouées dans l'ordre, après le démarrage à froid
+interactions = {
+    "Accueil": [("installations", check("Afficher installations"))] + zone_interactions,
+    "Puissance": zone_interactions,
+    "Production": zone_interactions,
+    "Installations": zone_interactions,
+    "Comparaison": [
+        (
+            "regions",
+            lambda at: at.multiselect(key="regions").set_value(
+                ["Grand Est", "Bretagne"]
+            ),
+        ),
+        (
+            "departements",
+            lambda at: at.multiselect(key="departements").set_value(["Marne"]),
+        ),
+        ("filiere", check("Eolien", False)),
+        (
+            "classement",
+            lambda at: at.radio(key="mode_comparaison").set_value("Classement"),
+        ),
+        ("classement_epci", select("type_classement", "Epci")),
+        ("situer_epci", select("zone_classement", "CC Marne 0")),
+    ],
+}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_page(page, repeat=5):
+    """
+    Lance la page et ses interactions (dans le processus courant, depuis le répertoire qui contient data/).
+    Les imports sont mesurés à part (voir import_page) et ne sont pas compris dans le démarrage à froid
+
+    Args:
+        page: str, nom court de la page
+        repeat: int, nombre de réexécutions sans changement
+
+    Returns: dict avec imports, geo_modules, cold_start, rerun (médiane), interactions, peak_rss_mb et errors
+        (en secondes / Mo)
+    """
+    result = import_page(page)
+    from streamlit.testing.v1 import AppTest
+
+    def timed(action):
+        start = time.perf_counter()
+        action().run()
+        return time.perf_counter() - start
+
+    at = AppTest.from_file(str(get_pages()[page]), default_timeout=600)
+    result["cold_start"] = timed(lambda: at)
+    result["rerun"] = statistics.median(timed(lambda: at) for _ in range(repeat))
+    result["interactions"] = {
+        name: timed(lambda: interaction(at)) for name, interaction in interactions[page]
+    }
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["errors"] = [x.value for x in at.exception]
+    return result
+
+
+def run_scale(directory, n_installations, pages, repeat=5):
+    """
+    Génère les données (si besoin) et mesure chaque page dans un processus séparé
+
+    Args:
+        directory: Path, répertoire de travail pour cette taille
+        n_installations: int
+        pages: liste des pages à mesurer
+        repeat: int, nombre de réexécutions sans changement
+
+    Returns: dict {page: mesures}
+    """
+    from benchmarks.synthetic import generate
+
+    data = directory / "data"
+    env = {
+        k: v
+        for k, v in os.environ.items()
+        if k not in ("AWS_S3_ENDPOINT", "ENR_SHARED_DIR")
+    }
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(root), env.get("PYTHONPATH")])
+    )
+    if not (data / "indicateurs.csv").exists():
+        start = time.perf_counter()
+        generate(data, n_installations)
+        # Fichiers prêts à l'emploi, comme en production (voir enr_app.build)
+        subprocess.run(
+            [sys.executable, "-m", "enr_app.build"],
+            cwd=directory,
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+        print(
+            f"{n_installations}: données générées en {time.perf_counter() - start:.1f} s"
+        )
+    results = {}
+    for page in pages:
+        child = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                "--child",
+                page,
+                "--repeat",
+                str(repeat),
+            ],
+            cwd=directory,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        try:
+            results[page] = json.loads(child.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            results[page] = {"errors": [child.stderr[-2000:]]}
+    return results
+
+
+def print_table(results):
+    for scale, pages in results.items():
+        print(f"\n{scale} installations")
+        print(
+            f"{'page':<14}{'imports (s)':>12}{'froid (s)':>10}{'rerun (s)':>10}{'max interaction (s)':>21}"
+            f"{'RSS (Mo)':>10}  bibliothèques géographiques"
+        )
+        for page, r in pages.items():
+            if "cold_start" not in r:
+                print(f"{page:<14} erreur: {r['errors']}")
+                continue
+            worst = max(r["interactions"].items(), key=lambda x: x[1])
+            print(
+                f"{page:<14}{r['imports']:>12.2f}{r['cold_start']:>10.2f}{r['rerun']:>10.3f}"
+                f"{worst[1]:>13.3f} ({worst[0]}){r['peak_rss_mb']:>10.0f}  {', '.join(r['geo_modules']) or '-'}"
+                + (f"  erreurs: {r['errors']}" if r["errors"] else "")
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--pages", nargs="+", default=list(get_pages()))
+    parser.add_argument("--workdir", type=Path, default=Path("/tmp/enr_bench"))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="fichier json des résultats")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_page(args.child, args.repeat)))
+        return
+    results = {
+        scale: run_scale(args.workdir / str(scale), scale, args.pages, args.repeat)
+        for scale in args.scales
+    }
+    print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=1), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
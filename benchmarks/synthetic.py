@@ -0,0 +1,219 @@
+__doc__ = """Génération de fichiers de données synthétiques, au format de data/, pour les mesures de performance
+
+Les départements et régions sont ceux de l'instantané enr_app/zones.json, placés sur une grille en Lambert 93,
+chaque département étant découpé en bandes verticales (EPCIs) où les installations sont tirées au hasard.
+
+Les fichiers de données du répertoire sont remplacés : il ne doit pas s'agir du répertoire data/ de l'application.
+
+Usage: python -m benchmarks.synthetic <nombre d'installations> <répertoire>"""
+
+import sys
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from enr_app.artifact import prepare_installations_biogaz
+from enr_app.general import filieres
+from enr_app.zones import read_snapshot
+
+crs = "EPSG:2154"
+# Emprise de la grille des départements (Lambert 93, m)
+x_min, y_min, cell = 100000, 6050000, 100000
+annees = range(2008, 2022)
+# Comme dans les données réelles, l'injection de biométhane n'est que dans la couche des installations biogaz
+filieres_installations = [x for x in filieres if x != "Injection de biométhane"]
+
+
+def make_zones(epcis_per_departement):
+    """
+    Args:
+        epcis_per_departement: int
+
+    Returns: tuple (GeoDataFrame régions, GeoDataFrame départements, GeoDataFrame EPCIs), en Lambert 93
+    """
+    snapshot = read_snapshot()
+    regions = {x["code"]: x["nom"] for x in snapshot["regions"]}
+    n_cols = int(np.ceil(np.sqrt(len(snapshot["departements"]))))
+    departements = []
+    epcis = []
+    for i, dep in enumerate(snapshot["departements"]):
+        x0 = x_min + (i % n_cols) * cell
+        y0 = y_min + (i // n_cols) * cell
+        departements.append(
+            {
+                "DEP": dep["code"],
+                "NOM_DEP": dep["nom"],
+                "REG": dep["codeRegion"],
+                "NOM_REG": regions[dep["codeRegion"]],
+                "geometry": shapely.box(x0, y0, x0 + cell, y0 + cell),
+            }
+        )
+        width = cell / epcis_per_departement
+        for k in range(epcis_per_departement):
+            epcis.append(
+                {
+                    "EPCI": f"2{dep['code'].zfill(3)}{k:04d}",
+                    "Zone": f"CC {dep['nom']} {k}",
+                    "DEPARTEMENTS_DE_L_EPCI": dep["code"],
+                    "NOM_DEP": dep["nom"],
+                    "NOM_REG": regions[dep["codeRegion"]],
+                    "geometry": shapely.box(
+                        x0 + k * width, y0, x0 + (k + 1) * width, y0 + cell
+                    ),
+                }
+            )
+    departements = gpd.GeoDataFrame(departements, crs=crs)
+    epcis = gpd.GeoDataFrame(epcis, crs=crs)
+    # Côtés découpés tous les km : les contours reprojetés en EPSG:4326 contiennent toujours les mêmes points
+    for zones in (departements, epcis):
+        zones.geometry = shapely.segmentize(zones.geometry.values, 1000)
+    regions = departements.dissolve(["REG", "NOM_REG"], as_index=False)[
+        ["REG", "NOM_REG", "geometry"]
+    ]
+    return regions, departements, epcis
+
+
+def make_installations(epcis, n, rng):
+    """
+    Args:
+        epcis: GeoDataFrame, comme retourné par make_zones
+        n: int, nombre d'installations
+        rng: numpy.random.Generator
+
+    Returns: GeoDataFrame en EPSG:4326, avec les colonnes de la couche installations de app.gpkg
+    """
+    idx = rng.integers(0, len(epcis), n)
+    bounds = epcis.bounds.to_numpy()[idx]
+    x = bounds[:, 0] + rng.random(n) * (bounds[:, 2] - bounds[:, 0])
+    y = bounds[:, 1] + rng.random(n) * (bounds[:, 3] - bounds[:, 1])
+    return gpd.GeoDataFrame(
+        {
+            "nominstallation": [f"Installation {i}" for i in range(n)],
+            "Filière": np.asarray(filieres_installations)[
+                rng.integers(0, len(filieres_installations), n)
+            ],
+            "typo": rng.choice(["Parc", "Toiture", "Ombrière"], n),
+            "date_inst": pd.Timestamp("2008-01-01")
+            + pd.to_timedelta(rng.integers(0, 5000, n), unit="D"),
+            "puiss_MW": rng.lognormal(0, 1.5, n),
+            "energie_GWh": rng.lognormal(0.5, 1.5, n),
+            "NOM_EPCI": epcis["Zone"].to_numpy()[idx],
+            "NOM_DEP": epcis["NOM_DEP"].to_numpy()[idx],
+            "NOM_REG": epcis["NOM_REG"].to_numpy()[idx],
+        },
+        geometry=gpd.points_from_xy(x, y),
+        crs=crs,
+    ).to_crs(4326)
+
+
+def make_indicateurs(installations, rng):
+    """
+    Indicateurs annuels par zone et filière, calculés à partir des installations mises en service chaque année
+
+    Returns: DataFrame au format de indicateurs.csv
+    """
+    frames = []
+    annee_inst = installations["date_inst"].dt.year
+    zones = [
+        ("Régions", None),
+        ("Régions", "NOM_REG"),
+        ("Départements", "NOM_DEP"),
+        ("Epci", "NOM_EPCI"),
+    ]
+    for type_zone, column in zones:
+        for annee in annees:
+            actives = installations[annee_inst <= annee]
+            zone = actives[column] if column else pd.Series("Toutes", actives.index)
+            df = (
+                actives.groupby([zone.rename("Zone"), "Filière"])
+                .agg(
+                    puiss_MW=("puiss_MW", "sum"),
+                    energie_GWh=("energie_GWh", "sum"),
+                    **{"Nombre de sites": ("puiss_MW", "size")},
+                )
+                .reset_index()
+            )
+            df.insert(0, "TypeZone", type_zone)
+            df.insert(3, "annee", annee)
+            frames.append(df)
+    indicateurs = pd.concat(frames, ignore_index=True)
+    indicateurs["energie_GWh"] *= rng.uniform(0.8, 1.2, len(indicateurs))
+    indicateurs["type_estimation"] = "synthétique"
+    return indicateurs
+
+
+def generate(directory, n_installations, epcis_per_departement=12, seed=0):
+    """
+    Écrit app.gpkg (installations, regions, departements, EPCIs), installations.gpkg, epcis.csv,
+    indicateurs.csv et objectifs_SRADDET_GrandEst.csv dans le répertoire
+
+    Args:
+        directory: str ou Path
+        n_installations: int
+        epcis_per_departement: int (default: 12, environ 1200 EPCIs comme en France)
+        seed: int, graine du générateur aléatoire
+
+    Returns: None
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    regions, departements, epcis = make_zones(epcis_per_departement)
+    installations = make_installations(epcis, n_installations, rng)
+
+    app = directory / "app.gpkg"
+    app.unlink(missing_ok=True)
+    installations.to_file(app, layer="installations")
+    regions.to_file(app, layer="regions")
+    departements[["DEP", "NOM_DEP", "NOM_REG", "geometry"]].to_file(
+        app, layer="departements"
+    )
+    epcis[["Zone", "geometry"]].to_file(app, layer="EPCIs")
+
+    n_biogaz = max(n_installations // 100, 10)
+    biogaz_epcis = epcis.sample(n_biogaz, replace=True, random_state=seed)
+    biogaz = gpd.GeoDataFrame(
+        {
+            "nom_du_projet": [f"Projet {i}" for i in range(n_biogaz)],
+            "date_de_mes": (
+                pd.Timestamp("2012-01-01")
+                + pd.to_timedelta(rng.integers(0, 3500, n_biogaz), unit="D")
+            ).strftime("%Y-%m-%d"),
+            "quantite_annuelle_injectee_en_mwh": rng.random(n_biogaz) * 1e4,
+            "type": "Injection",
+            "capacite_de_production_gwh_an": rng.random(n_biogaz) * 50,
+        },
+        geometry=biogaz_epcis.geometry.centroid.to_numpy(),
+        crs=crs,
+    )
+    (directory / "installations.gpkg").unlink(missing_ok=True)
+    biogaz.to_file(directory / "installations.gpkg", layer="installations_biogaz")
+
+    epcis.rename(columns={"Zone": "NOM_EPCI"})[
+        ["EPCI", "NOM_EPCI", "DEPARTEMENTS_DE_L_EPCI"]
+    ].to_csv(directory / "epcis.csv", index=False)
+    sites_biogaz = prepare_installations_biogaz(biogaz).assign(
+        date_inst=lambda x: pd.to_datetime(x["date_inst"]),
+        NOM_EPCI=biogaz_epcis["Zone"].to_numpy(),
+        NOM_DEP=biogaz_epcis["NOM_DEP"].to_numpy(),
+        NOM_REG=biogaz_epcis["NOM_REG"].to_numpy(),
+    )
+    make_indicateurs(pd.concat([installations, sites_biogaz.to_crs(4326)]), rng).to_csv(
+        directory / "indicateurs.csv", index=False
+    )
+    pd.DataFrame(
+        {
+            "Filière": filieres,
+            "2030": [1000, 200, 300, 4000],
+            "2050": [3000, 500, 600, 9000],
+        }
+    ).to_csv(directory / "objectifs_SRADDET_GrandEst.csv", sep=";", index=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.splitlines()[-1])
+    generate(sys.argv[2], int(sys.argv[1]))
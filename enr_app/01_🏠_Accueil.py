@@ -1,20 +1,39 @@
 import folium
 import streamlit as st
-from streamlit_folium import folium_static
+from streamlit_folium import st_folium
 
+from enr_app.exports import export_buttons, export_formats
 from enr_app.general import (
     get_sources,
-    icon_colors,
     remove_page_items,
     select_filieres,
-    select_indicateur,
-    select_installations,
     select_zone,
+    sum_indicateur,
+)
+from enr_app.installations import (
+    installations_columns,
+    installations_reader,
+    select_installations,
+    select_installations_in_bounds,
+)
+from enr_app.map_functions import (
+    add_marker_layers,
+    get_map,
+    get_map_bounds,
+    get_map_html,
+    grid_shadings,
+    max_markers,
 )
-from enr_app.map_functions import get_map
+from enr_app.store import store
+from enr_app.table import paginated_table
+from enr_app.timing import lap, start_rerun, timing_panel
+from enr_app.warmup import is_loading, start_warm_up
 
 st.set_page_config("Outil EnR")
 remove_page_items()
+start_warm_up()  # sans effet si déjà lancé par enr_app.serve
+start_rerun("Accueil")
+store.pin()  # mêmes versions des données pendant toute l'exécution
 st.write("# Bienvenu à l'outil EnR")
 
 type_zone, zone = select_zone()
@@ -37,12 +56,13 @@ tuiles = {
 }
 
 for col, (indicateur, tuile) in zip(st.columns(3), tuiles.items()):
-    df = select_indicateur(type_zone, zone, filieres, annee, indicateur)
-    if df.empty:
+    total = sum_indicateur(type_zone, zone, filieres, annee, indicateur)
+    if total is None:
         col.metric(tuile["texte"], "N/A")
     else:
-        col.metric(tuile["texte"], tuile["valeur"](df.sum()))
+        col.metric(tuile["texte"], tuile["valeur"](total))
     col.caption(f"Source: {get_sources(indicateur, type_zone)}")
+lap("tuiles")
 
 # Carte
 st.markdown("## Installations en France métropolitaine et départements d'outre-mer")
@@ -55,54 +75,90 @@ st.session_state["show_installations"] = st.checkbox(
     "Afficher installations", st.session_state.get("show_installations", False)
 )
 
-mapa = get_map(type_zone, zone)
-if st.session_state["show_installations"]:
-    columns = [
-        "nominstallation",
-        "Filière",
-        "typo",
-        "date_inst",
-        "puiss_MW",
-        "energie_GWh",
-        "NOM_EPCI",
-        "NOM_DEP",
-        "NOM_REG",
-    ]
+interactive = st.session_state["show_installations"] and st.checkbox(
+    "Carte interactive (affiche les installations visibles en déplaçant la carte)",
+    key="carte_interactive",
+)
+
+show_installations = st.session_state["show_installations"]
+if (
+    show_installations
+    and installations_reader == "memory"
+    and is_loading("installations", "index_installations")
+):
+    st.info(
+        "Installations en cours de chargement, elles seront affichées au prochain rafraîchissement"
+    )
+    show_installations = interactive = False
+
+columns = installations_columns
+if show_installations:
     installations = select_installations(type_zone, zone, filieres).reset_index()
-    mapa.location = [
-        installations.geometry.y.median(),
-        installations.geometry.x.median(),
-    ]
     n_installations = len(installations)
-    max_installations = 1000
-    subset = installations.iloc[:max_installations]  # TODO: remove limitation ?
-    if n_installations:
-        if n_installations > max_installations:
-            st.write(
-                f"N.B.: uniquement {max_installations} installations affichées. "
-                "Veuillez sélectionner une zone plus restreinte"
-            )
-        tooltip = folium.GeoJsonTooltip(["nominstallation", "Filière"])
-        popup = folium.GeoJsonPopup(columns)
-        for (name, group) in subset.groupby("Filière"):
-            tooltip = folium.GeoJsonTooltip(["nominstallation", "Filière"])
-            popup = folium.GeoJsonPopup(columns)
-            marker = folium.Marker(icon=folium.Icon(color=icon_colors[name]))
-            gjson = folium.GeoJson(
-                group, name=name, tooltip=tooltip, popup=popup, marker=marker
-            )
-            gjson.add_to(mapa)
 
-folium.LayerControl().add_to(mapa)
-folium_static(mapa)
-if st.session_state["show_installations"]:
+if interactive:
+    mapa = get_map(type_zone, zone)
+    folium.LayerControl().add_to(mapa)
+    # Une clé par zone : la carte d'une nouvelle zone démarre sur les limites de la zone
+    key = f"carte_{type_zone}_{zone}"
+    bounds = get_map_bounds(st.session_state.get(key), type_zone, zone)
+    visibles, n_visibles = select_installations_in_bounds(
+        type_zone, zone, filieres, bounds, max_markers
+    )
+    group = folium.FeatureGroup(name="Installations")
+    add_marker_layers(group, visibles, columns)
+    st_folium(
+        mapa,
+        key=key,
+        returned_objects=["bounds"],
+        feature_group_to_add=group,
+        width=700,
+    )
+    st.caption(
+        f"{len(visibles)} installations affichées sur {n_visibles} visibles"
+        + (" (les plus puissantes)" if n_visibles > len(visibles) else "")
+    )
+else:
+    shading = "n"
+    if show_installations and (
+        type_zone == "Régions" or n_installations > max_markers
+    ):  # installations regroupées (voir add_installations)
+        shading = st.radio(
+            "Intensité des cellules",
+            list(grid_shadings),
+            format_func=grid_shadings.get,
+            horizontal=True,
+            key="intensite_grille",
+        )
+    html, grouped = get_map_html(
+        type_zone, zone, filieres, show_installations, columns, shading
+    )
+    if grouped:
+        st.write(
+            "N.B.: installations regroupées par cellule, la couleur est plus foncée "
+            + (
+                "s'il y en a davantage. "
+                if shading == "n"
+                else "si leur puissance totale est plus élevée. "
+            )
+            + "Veuillez sélectionner une zone plus restreinte pour afficher chaque installation"
+        )
+    st.iframe(html, width=700, height=510)
+lap("carte")
+if show_installations:
     st.caption(f'Source: {get_sources("installations", type_zone)}')
-    st.download_button(
-        "Exporter au format csv",
-        data=installations[columns].to_csv(index=False),
-        file_name="installations.csv",
-        mime="text/csv",
+    export_buttons(
+        installations[columns + ["x", "y"]],
+        "installations",
+        ("installations", type_zone, zone, tuple(filieres)),
+        formats=list(export_formats),
+    )
+    paginated_table(
+        installations[columns],
+        ("installations", type_zone, zone, tuple(filieres)),
+        search_columns=["nominstallation", "Filière", "typo", "NOM_EPCI", "NOM_DEP"],
     )
-    st.dataframe(installations[columns])
     st.caption(f'Source: {get_sources("installations", type_zone)}')
     st.write(f"Installations: {n_installations}")
+    lap("tableau")
+timing_panel()
@@ -0,0 +1,11 @@
+import pandas as pd
+
+# Les sessions reçoivent des vues des jeux de données partagés (copies superficielles, voir enr_app.store) : avec
+# copy-on-write, une modification dans une session déclenche une copie locale et ne touche jamais la donnée
+# partagée. Toujours actif avec pandas >= 3, à activer avec pandas 2, absent avant
+if int(pd.__version__.split(".")[0]) < 2:
+    raise ImportError(
+        f"enr_app demande pandas >= 2 (copy-on-write), pas {pd.__version__}"
+    )
+if int(pd.__version__.split(".")[0]) == 2:
+    pd.set_option("mode.copy_on_write", True)
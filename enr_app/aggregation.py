@@ -0,0 +1,365 @@
+__doc__ = """Calcul des indicateurs (puiss_MW, energie_GWh, Nombre de sites) par zone, filière et année à partir des
+couches des installations (ODRÉ) et des installations biogaz (injection de biométhane), au format de indicateurs.csv
+
+La valeur d'une année est la somme sur les installations mises en service au plus tard cette année-là. Le calcul est
+fait d'un coup pour toutes les zones d'un niveau (np.bincount sur un tableau zone × filière × année, puis somme
+cumulée sur les années). La contribution de chaque installation est gardée avec une empreinte : au calcul suivant,
+seules les séries (zone, filière) dont une installation a changé sont recalculées, à partir de la première année
+concernée, et seules les nouvelles années sont calculées pour toutes les zones.
+
+Usage: python -m enr_app.aggregation [--full] [--verify] [--annees 2008 2021]"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from enr_app.general import (
+    indicateurs_dtypes,
+    indicateurs_index,
+    open_file,
+    region_default,
+)
+
+# Niveaux de zones : (TypeZone, colonne des installations avec le nom de la zone, None pour toute la France)
+levels = [
+    ("Régions", None),
+    ("Régions", "NOM_REG"),
+    ("Départements", "NOM_DEP"),
+    ("Epci", "NOM_EPCI"),
+]
+indicateurs_columns = ["puiss_MW", "energie_GWh", "Nombre de sites"]
+# Colonnes des couches d'installations utilisées
+contributions_columns = [
+    "Filière",
+    "date_inst",
+    "puiss_MW",
+    "energie_GWh",
+    "NOM_EPCI",
+    "NOM_DEP",
+    "NOM_REG",
+]
+# Indicateurs de indicateurs.csv pris au SDES pour les régions et départements (voir registry_rows)
+sdes_columns = ["puiss_MW", "Nombre de sites"]
+# Indicateurs estimés autrement dans indicateurs.csv : les écarts sont affichés mais ne font pas échouer --verify
+estimated_columns = ["energie_GWh"]
+output_name = "indicateurs_installations.parquet"
+state_name = "indicateurs_installations_etat.parquet"
+
+
+def read_contributions():
+    """
+    Lit les colonnes utiles de la couche des installations, sans les géométries (voir enr_app.artifact.layer_source),
+    et la couche des installations biogaz, dont les zones sont attribuées d'après la géométrie (voir
+    enr_app.spatial.locate_installations)
+
+    Returns: DataFrame des contributions (voir contributions)
+    """
+    import pyogrio
+
+    from enr_app.artifact import layer_source, read_layer
+    from enr_app.spatial import locate_installations, zone_layers
+
+    path, layer = layer_source("installations")
+    installations = pyogrio.read_dataframe(
+        path,
+        layer=layer,
+        columns=contributions_columns,
+        read_geometry=False,
+        use_arrow=True,
+    )
+    biogaz = read_layer("installations_biogaz")
+    contours = {layer: read_layer(layer) for layer, _ in zone_layers.values()}
+    biogaz = biogaz.assign(**locate_installations(biogaz, contours))
+    return contributions(
+        pd.concat(
+            [installations, pd.DataFrame(biogaz[contributions_columns])],
+            ignore_index=True,
+        )
+    )
+
+
+def contributions(installations):
+    """
+    Contribution de chaque installation aux indicateurs, avec une empreinte de la ligne pour repérer les
+    installations ajoutées, supprimées ou modifiées entre deux calculs
+
+    Args:
+        installations: DataFrame avec Filière, date_inst, puiss_MW, energie_GWh, NOM_EPCI, NOM_DEP, NOM_REG
+
+    Returns: DataFrame avec les zones et Filière (catégories), annee_inst, puiss_MW, energie_GWh et empreinte
+    """
+    df = pd.DataFrame(
+        {
+            "NOM_REG": installations["NOM_REG"].astype("category"),
+            "NOM_DEP": installations["NOM_DEP"].astype("category"),
+            "NOM_EPCI": installations["NOM_EPCI"].astype("category"),
+            "Filière": installations["Filière"].astype("category"),
+            "annee_inst": pd.to_datetime(
+                installations["date_inst"], errors="coerce"
+            ).dt.year,
+            "puiss_MW": pd.to_numeric(installations["puiss_MW"], errors="coerce"),
+            "energie_GWh": pd.to_numeric(installations["energie_GWh"], errors="coerce"),
+        }
+    )
+    df = df.loc[df["annee_inst"].notna()].astype({"annee_inst": "int16"})
+    df["empreinte"] = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return df.reset_index(drop=True)
+
+
+def aggregate(contributions, annees, levels=levels):
+    """
+    Indicateurs de toutes les zones des niveaux demandés, pour les années demandées
+
+    Args:
+        contributions: DataFrame (voir contributions)
+        annees: années à calculer
+        levels: niveaux de zones (default: tous)
+
+    Returns: DataFrame au format de indicateurs.csv, seulement pour les séries avec au moins une installation
+    """
+    annees = np.sort(np.asarray(annees, dtype=np.int16))
+    # Une installation compte à partir de la première année calculée >= son année de mise en service
+    bins = np.searchsorted(annees, contributions["annee_inst"].to_numpy(), side="left")
+    values = [
+        np.nan_to_num(contributions["puiss_MW"].to_numpy(dtype=float)),
+        np.nan_to_num(contributions["energie_GWh"].to_numpy(dtype=float)),
+        np.ones(len(bins)),  # nombre de sites
+    ]
+    filiere_codes, filieres = pd.factorize(contributions["Filière"])
+    frames = []
+    for type_zone, column in levels:
+        zone = _zone(contributions, column)
+        zone_codes, zones = pd.factorize(zone)
+        keep = (bins < len(annees)) & (zone_codes >= 0) & (filiere_codes >= 0)
+        shape = (len(zones), len(filieres), len(annees))
+        flat = np.ravel_multi_index(
+            (zone_codes[keep], filiere_codes[keep], bins[keep]), shape
+        )
+        size = int(np.prod(shape))
+        cube = np.stack(
+            [np.bincount(flat, x[keep], size).reshape(shape) for x in values], axis=-1
+        ).cumsum(axis=2)
+        z, f, a = np.nonzero(np.round(cube[..., 2]) > 0)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "TypeZone": type_zone,
+                    "Zone": np.asarray(zones, dtype=object)[z],
+                    "Filière": np.asarray(filieres, dtype=object)[f],
+                    "annee": annees[a],
+                    "puiss_MW": cube[z, f, a, 0],
+                    "energie_GWh": cube[z, f, a, 1],
+                    "Nombre de sites": np.round(cube[z, f, a, 2]).astype(np.int64),
+                }
+            )
+        )
+    indicateurs = pd.concat(frames, ignore_index=True)
+    indicateurs["type_estimation"] = "registre des installations"
+    return indicateurs
+
+
+def _zone(contributions, column):
+    if column is None:  # toute la France
+        return pd.Series(region_default, index=contributions.index)
+    return contributions[column]
+
+
+def _since(depuis, rows):
+    # Première année modifiée de la série de chaque ligne (NaN : série inchangée)
+    return depuis.reindex(
+        pd.MultiIndex.from_frame(rows[["Zone", "Filière"]])
+    ).to_numpy()
+
+
+def changed_contributions(old, new):
+    """
+    Installations ajoutées, supprimées ou modifiées, avec un poids : nombre de lignes identiques (même empreinte)
+    dans new moins dans old. Une installation modifiée apparaît deux fois : ancienne version (-1), nouvelle (+1)
+
+    Returns: DataFrame des contributions concernées, avec la colonne poids
+    """
+    both = pd.concat([new, old], ignore_index=True)
+    sign = np.concatenate(
+        [np.ones(len(new), dtype=np.int64), -np.ones(len(old), dtype=np.int64)]
+    )
+    weights = pd.Series(sign).groupby(both["empreinte"].to_numpy()).sum()
+    weights = weights[weights != 0]
+    changed = (
+        both.drop_duplicates("empreinte").set_index("empreinte").loc[weights.index]
+    )
+    return changed.assign(poids=weights.to_numpy()).reset_index()
+
+
+def update(previous, old, new, annees):
+    """
+    Met à jour les indicateurs : seules les séries (TypeZone, Zone, Filière) dont une installation a changé sont
+    recalculées, à partir de la première année concernée, ainsi que les années qui n'avaient pas été calculées
+
+    Args:
+        previous: DataFrame, indicateurs calculés à partir de old (voir aggregate)
+        old: DataFrame, contributions du calcul précédent
+        new: DataFrame, contributions actuelles
+        annees: années à calculer
+
+    Returns: DataFrame des indicateurs, dict avec le nombre d'installations modifiées, de séries et de lignes
+        recalculées
+    """
+    annees = sorted(annees)
+    previous = previous.loc[previous["annee"].isin(annees)].astype(
+        {"TypeZone": str, "Zone": str, "Filière": str, "annee": "int16"}
+    )
+    new_annees = sorted(set(annees) - set(previous["annee"].unique()))
+    old_annees = sorted(set(annees) - set(new_annees))
+    changed = changed_contributions(old, new)
+
+    drop = np.zeros(len(previous), dtype=bool)
+    frames = [aggregate(new, new_annees)] if new_annees else []
+    n_series = 0
+    for type_zone, column in levels if len(changed) and old_annees else []:
+        # Première année modifiée par série (zone, filière)
+        depuis = changed.groupby(
+            [_zone(changed, column).rename("Zone"), "Filière"]
+        ).annee_inst.min()
+        n_series += len(depuis)
+        in_level = (previous["TypeZone"] == type_zone).to_numpy()
+        rows = previous.loc[in_level]
+        drop[in_level] |= rows["annee"].to_numpy() >= _since(depuis, rows)
+        keys = pd.MultiIndex.from_arrays([_zone(new, column), new["Filière"]])
+        computed = aggregate(
+            new.loc[keys.isin(depuis.index)],
+            [x for x in old_annees if x >= depuis.min()],
+            [(type_zone, column)],
+        )
+        frames.append(
+            computed.loc[computed["annee"].to_numpy() >= _since(depuis, computed)]
+        )
+    indicateurs = (
+        pd.concat([previous.loc[~drop]] + frames, ignore_index=True)
+        .sort_values(indicateurs_index)
+        .reset_index(drop=True)
+    )
+    recomputed = sum(len(x) for x in frames)
+    return indicateurs, {
+        "installations modifiées": len(changed),
+        "séries recalculées": n_series,
+        "lignes recalculées": recomputed,
+    }
+
+
+def registry_rows(df, col):
+    """
+    Lignes dont l'indicateur vient du registre des installations dans indicateurs.csv : puiss_MW et Nombre de
+    sites des régions et départements viennent du SDES, sauf pour l'injection de biométhane (voir
+    enr_app.general.get_sources)
+
+    Args:
+        df: DataFrame au format de indicateurs.csv
+        col: str, indicateur
+
+    Returns: array de booléens
+    """
+    if col not in sdes_columns:
+        return np.ones(len(df), dtype=bool)
+    return (
+        (df["TypeZone"] == "Epci") | (df["Filière"] == "Injection de biométhane")
+    ).to_numpy()
+
+
+def verify(indicateurs, reference, rtol=1e-6):
+    """
+    Compare les indicateurs calculés à des indicateurs de référence (par exemple indicateurs.csv), par type de
+    zone, sur les lignes communes qui viennent du registre des installations (voir registry_rows)
+
+    Args:
+        indicateurs: DataFrame au format de indicateurs.csv
+        reference: DataFrame au format de indicateurs.csv
+        rtol: float, écart relatif toléré
+
+    Returns: DataFrame par indicateur et type de zone avec lignes comparées, écarts, écart relatif maximum, lignes
+        absentes du calcul, lignes en plus et contrôlé (False pour les indicateurs estimés autrement, dont les
+        écarts sont attendus)
+    """
+    dtypes = {"TypeZone": str, "Zone": str, "Filière": str, "annee": "int64"}
+    indicateurs = indicateurs.astype(dtypes)
+    reference = reference.astype(dtypes)
+    report = {}
+    for col in indicateurs_columns:
+        if col not in reference:
+            continue
+        for type_zone in sorted(reference["TypeZone"].unique()):
+            left = indicateurs.loc[
+                registry_rows(indicateurs, col)
+                & (indicateurs["TypeZone"] == type_zone).to_numpy()
+            ].set_index(indicateurs_index)
+            right = reference.loc[
+                registry_rows(reference, col)
+                & (reference["TypeZone"] == type_zone).to_numpy()
+            ].set_index(indicateurs_index)
+            common = left.index.intersection(right.index)
+            a = left.loc[common, col].to_numpy(dtype=float)
+            b = right.loc[common, col].to_numpy(dtype=float)
+            close = np.isclose(a, b, rtol=rtol, atol=0, equal_nan=True)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                relative = np.abs(a - b) / np.abs(b)
+            report[col, type_zone] = {
+                "lignes": len(common),
+                "écarts": int((~close).sum()),
+                "écart relatif max": float(np.nanmax(relative, initial=0)),
+                "absentes": len(right.index.difference(left.index)),
+                "en plus": len(left.index.difference(right.index)),
+                "contrôlé": col not in estimated_columns,
+            }
+    return pd.DataFrame.from_dict(report, orient="index")
+
+
+def read_parquet(filename):
+    with open_file(filename, "rb") as file_in:
+        return pd.read_parquet(file_in)
+
+
+def write_parquet(df, filename):
+    with open_file(filename, "wb") as file_out:
+        df.to_parquet(file_out, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--full", action="store_true", help="recalcule tout, sans le calcul précédent"
+    )
+    parser.add_argument(
+        "--verify", action="store_true", help="compare le résultat à indicateurs.csv"
+    )
+    parser.add_argument("--annees", type=int, nargs=2, metavar=("DEBUT", "FIN"))
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    new = read_contributions()
+    first, last = args.annees or (new["annee_inst"].min(), new["annee_inst"].max())
+    annees = list(range(first, last + 1))
+    try:
+        if args.full:
+            raise FileNotFoundError
+        previous, old = read_parquet(output_name), read_parquet(state_name)
+        indicateurs, summary = update(previous, old, new, annees)
+    except FileNotFoundError:
+        indicateurs = aggregate(new, annees)
+        summary = {"lignes recalculées": len(indicateurs)}
+    write_parquet(indicateurs.astype(indicateurs_dtypes), output_name)
+    write_parquet(new, state_name)
+    print(
+        f"{output_name}: {len(indicateurs)} lignes en {time.perf_counter() - start:.1f} s, "
+        + ", ".join(f"{k}: {v}" for k, v in summary.items())
+    )
+    if args.verify:
+        with open_file("indicateurs.csv") as file_in:
+            report = verify(indicateurs, pd.read_csv(file_in))
+        print(report.to_string())
+        sys.exit(1 if report.loc[report["contrôlé"], "écarts"].sum() else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+__doc__ = """Lecture des couches de données par l'application : depuis app_data.gpkg s'il a été produit (voir
+enr_app.build), sinon depuis leurs fichiers sources, préparées à la lecture"""
+
+import geopandas as gpd
+
+from enr_app.general import artifact_name, load_metadata, local_path
+
+
+def prepare_installations_biogaz(installations):
+    return installations.rename(
+        columns={
+            "nom_du_projet": "nominstallation",
+            "date_de_mes": "date_inst",
+            "quantite_annuelle_injectee_en_mwh": "prod_MWh_an",
+            "type": "typo",
+        }
+    ).assign(
+        Filière="Injection de biométhane",
+        puiss_MW=lambda x: x["capacite_de_production_gwh_an"] / (365 * 24) * 1e3,
+        energie_GWh=lambda x: x["prod_MWh_an"] * 1e-3,
+    )
+
+
+# Couches de app_data.gpkg : (fichier source, couche source, préparation après reprojection)
+layers = {
+    "installations": ("app.gpkg", "installations", None),
+    "installations_biogaz": (
+        "installations.gpkg",
+        "installations_biogaz",
+        prepare_installations_biogaz,
+    ),
+    "regions": ("app.gpkg", "regions", None),
+    "departements": ("app.gpkg", "departements", None),
+    "EPCIs": ("app.gpkg", "EPCIs", None),
+}
+
+
+def prepare_layer(layer):
+    """
+    Lit une couche depuis son fichier source, la reprojette en EPSG:4326 et applique sa préparation
+
+    Args:
+        layer: str, nom de la couche dans app_data.gpkg (voir layers)
+
+    Returns: GeoDataFrame en EPSG:4326
+    """
+    filename, source_layer, prepare = layers[layer]
+    data = gpd.read_file(local_path(filename), layer=source_layer, use_arrow=True)
+    if data.crs is not None and data.crs.to_epsg() != 4326:
+        data = data.to_crs(epsg=4326)
+    return data if prepare is None else prepare(data)
+
+
+def read_layer(layer):
+    """
+    Lit une couche de app_data.gpkg sans autre traitement, ou, si le fichier n'a pas été produit, la prépare depuis
+    son fichier source (voir prepare_layer)
+
+    Args:
+        layer: str, nom de la couche (voir layers)
+
+    Returns: GeoDataFrame en EPSG:4326
+    """
+    metadata = load_metadata()
+    if metadata is None:
+        return prepare_layer(layer)
+    data = gpd.read_file(local_path(artifact_name), layer=layer, use_arrow=True)
+    if len(data) != metadata["layers"][layer]["rows"]:
+        raise ValueError(
+            f"{artifact_name}: {len(data)} lignes dans la couche {layer}, "
+            f"{metadata['layers'][layer]['rows']} attendues"
+        )
+    return data
+
+
+def layer_source(layer):
+    """
+    Fichier et couche à lire pour une couche sans préparation, avec des filtres (voir
+    enr_app.installations.read_installations)
+
+    Args:
+        layer: str, nom de la couche (voir layers)
+
+    Returns: chemin local, nom de la couche dans ce fichier
+    """
+    if load_metadata() is not None:
+        return local_path(artifact_name), layer
+    filename, source_layer, prepare = layers[layer]
+    if prepare is not None:
+        raise ValueError(f"La couche {layer} doit être préparée, voir enr_app.build")
+    return local_path(filename), source_layer
@@ -0,0 +1,177 @@
+__doc__ = """Préparation hors ligne des fichiers de données utilisés par l'application
+
+- indicateurs.parquet, à partir de indicateurs.csv
+- app_data.gpkg : installations et contours prêts à l'emploi (EPSG:4326, noms de colonnes finaux, colonnes
+  dérivées, zones des installations d'après leur géométrie), avec une table "metadata" (version du format,
+  empreintes des fichiers sources, nombre de lignes par couche, filières, corrections de zones). Sans ce fichier,
+  l'application prépare les couches à chaque démarrage, sans contrôle des zones (voir enr_app.artifact.read_layer)
+
+Usage: python -m enr_app.build [--check]"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+import pyogrio
+
+from enr_app.artifact import layers, prepare_layer
+from enr_app.general import (
+    artifact_name,
+    artifact_version,
+    get_filesystem,
+    indicateurs_dtypes,
+    load_metadata,
+    load_zones,
+    local_path,
+    open_file,
+    s3_bucket,
+)
+from enr_app.spatial import assign_zones
+
+
+def build_indicateurs():
+    """
+    Convertit indicateurs.csv en indicateurs.parquet : format colonne pour ne lire que les indicateurs utilisés,
+    avec zones et filières encodées en catégories
+
+    Returns: None
+    """
+    with open_file("indicateurs.csv") as file_in:
+        indicateurs = pd.read_csv(file_in).astype(indicateurs_dtypes)
+    with open_file("indicateurs.parquet", "wb") as file_out:
+        indicateurs.to_parquet(file_out, index=False)
+
+
+def file_digest(filename):
+    """
+    Returns: dict avec sha256 et size du fichier de données
+    """
+    path = local_path(filename)
+    digest = hashlib.sha256()
+    with open(path, "rb") as file_in:
+        for block in iter(lambda: file_in.read(1 << 20), b""):
+            digest.update(block)
+    return {"sha256": digest.hexdigest(), "size": os.path.getsize(path)}
+
+
+def source_digests():
+    """
+    Returns: dict {fichier source: empreinte (voir file_digest)}
+    """
+    return {
+        filename: file_digest(filename)
+        for filename in sorted({source for source, _, _ in layers.values()})
+    }
+
+
+def build_artifact():
+    """
+    Produit app_data.gpkg : chaque couche est préparée (voir prepare_layer), les zones des installations sont
+    attribuées d'après leur géométrie (voir enr_app.spatial.assign_zones), puis chaque couche est écrite avec son
+    index spatial, avec la table "metadata". Le fichier est écrit à part puis remplace l'ancien en une fois
+
+    Returns: dict, métadonnées écrites
+    """
+    sources = source_digests()
+    metadata = {
+        "format_version": artifact_version,
+        "data_version": hashlib.sha256(
+            json.dumps(sources, sort_keys=True).encode()
+        ).hexdigest()[:16],
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sources": sources,
+        "layers": {},
+    }
+    prepared = {layer: prepare_layer(layer) for layer in layers}
+    # Zones des installations d'après leur géométrie, contours d'EPCI manquants complétés (voir enr_app.spatial)
+    prepared["installations"], prepared["EPCIs"], metadata["zones"] = assign_zones(
+        prepared["installations"], prepared, load_zones()
+    )
+    filieres = set()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, artifact_name)
+        for layer, data in prepared.items():
+            data.to_file(path, layer=layer, driver="GPKG")
+            metadata["layers"][layer] = {
+                "rows": len(data),
+                "columns": list(data.columns),
+                "crs": "EPSG:4326",
+                "bounds": [float(x) for x in data.total_bounds],
+            }
+            if "Filière" in data:
+                filieres.update(data["Filière"].dropna().unique())
+        metadata["filieres"] = sorted(filieres)
+        pyogrio.write_dataframe(
+            pd.DataFrame(
+                {
+                    "key": list(metadata),
+                    "value": [
+                        json.dumps(x, ensure_ascii=False) for x in metadata.values()
+                    ],
+                }
+            ),
+            path,
+            layer="metadata",
+        )
+        if "AWS_S3_ENDPOINT" in os.environ:
+            get_filesystem().put(str(path), f"{s3_bucket}/{artifact_name}")
+        else:
+            target = Path("data", artifact_name)
+            shutil.copyfile(path, target.with_name(f"{artifact_name}.tmp"))
+            os.replace(target.with_name(f"{artifact_name}.tmp"), target)
+    return metadata
+
+
+def check_artifact():
+    """
+    Vérifie que app_data.gpkg existe, est au format actuel et a été produit à partir des fichiers sources actuels
+
+    Returns: liste des problèmes (vide si le fichier est à jour)
+    """
+    metadata = load_metadata()
+    if metadata is None:
+        return [f"{artifact_name} absent ou d'une autre version du format"]
+    problems = []
+    for filename, digest in source_digests().items():
+        if metadata["sources"].get(filename) != digest:
+            problems.append(
+                f"{filename} a changé depuis la production de {artifact_name}"
+            )
+    for layer, info in metadata["layers"].items():
+        rows = pyogrio.read_info(local_path(artifact_name), layer=layer)["features"]
+        if rows != info["rows"]:
+            problems.append(f"{layer}: {rows} lignes, {info['rows']} attendues")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=f"vérifie que {artifact_name} est à jour (code de sortie 1 sinon)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = check_artifact()
+        for problem in problems:
+            print(problem)
+        sys.exit(1 if problems else 0)
+    build_indicateurs()
+    metadata = build_artifact()
+    print(
+        f"{artifact_name} version {metadata['data_version']}: "
+        + ", ".join(f"{k} ({v['rows']})" for k, v in metadata["layers"].items())
+    )
+
+
+if __name__ == "__main__":
+    main()
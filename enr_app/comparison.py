@@ -0,0 +1,80 @@
+__doc__ = """Classement de toutes les zones d'un type (régions, départements ou EPCIs) pour un indicateur, une année
+et des filières : valeur, rang, percentile et évolution sur un an, calculés en une seule passe sur les indicateurs
+et gardés en cache"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from enr_app.general import load_indicateur, region_default
+from enr_app.store import RenderCache
+from enr_app.timing import timed
+
+# Classements par type de zone, indicateur, année et filières
+ranking_cache = RenderCache(
+    int(os.environ.get("ENR_RANKING_CACHE_SIZE", 32)), "classements"
+)
+
+
+def get_annees(indicateur):
+    """
+    Returns: liste triée des années disponibles pour l'indicateur
+    """
+    annees = load_indicateur(indicateur).index.get_level_values("annee")
+    return sorted(annees.unique().tolist())
+
+
+@timed
+def rank_zones(type_zone, indicateur, annee, filieres):
+    """
+    Classe toutes les zones du type selon la somme de l'indicateur sur les filières choisies (rang 1 : valeur la
+    plus élevée). Le percentile est la part des zones dont la valeur est inférieure ou égale
+
+    Args:
+        type_zone: str, (Régions, Départements ou Epci)
+        indicateur: str
+        annee: int
+        filieres: list
+
+    Returns: DataFrame trié par rang avec Zone, valeur, rang, percentile, valeur de l'année précédente et évolution
+        (%), seulement pour les zones avec une valeur
+    """
+
+    def compute():
+        indicateurs = load_indicateur(indicateur)[indicateur]
+        index = indicateurs.index
+        zones = index.get_level_values("Zone")
+        mask = (
+            (index.get_level_values("TypeZone") == type_zone)
+            & index.get_level_values("Filière").isin(filieres)
+            & index.get_level_values("annee").isin([annee, annee - 1])
+            & (zones != region_default)
+        )
+        values = (
+            indicateurs[np.asarray(mask)]
+            .groupby(level=["Zone", "annee"], observed=True)
+            .sum(min_count=1)
+            .unstack("annee")
+            .reindex(columns=[annee, annee - 1])
+        )
+        df = pd.DataFrame(
+            {
+                "Zone": values.index.astype(str),
+                "valeur": values[annee].to_numpy(dtype=float),
+                "valeur N-1": values[annee - 1].to_numpy(dtype=float),
+            }
+        ).dropna(subset="valeur")
+        df.insert(2, "rang", df["valeur"].rank(ascending=False, method="min"))
+        df.insert(3, "percentile", df["valeur"].rank(pct=True, method="max") * 100)
+        previous = df["valeur N-1"].where(df["valeur N-1"] > 0)
+        df["évolution (%)"] = (df["valeur"] / previous - 1) * 100
+        return (
+            df.astype({"rang": int})
+            .sort_values(["rang", "Zone"], kind="stable")
+            .reset_index(drop=True)
+        )
+
+    return ranking_cache.get(
+        (type_zone, indicateur, annee, tuple(sorted(filieres))), compute
+    )
@@ -0,0 +1,142 @@
+__doc__ = """Indicateurs rangés dans un tableau NumPy dense (zone × filière × année × indicateur), pour des sélections
+en temps constant qui ne dépendent pas de la taille des données"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+
+class IndicateurCube:
+    """
+    Cube dense des indicateurs numériques, avec des tables de correspondance nom → code pour chaque dimension.
+    Les sélections retournent les mêmes DataFrame / Series que DataFrame.loc sur les indicateurs
+    """
+
+    def __init__(self, indicateurs):
+        """
+        Args:
+            indicateurs: DataFrame avec index (TypeZone, Zone, Filière, annee)
+        """
+        self.index_names = list(indicateurs.index.names)
+        df = indicateurs.reset_index()
+        self.indicateurs = [
+            col
+            for col in df.columns.drop(self.index_names)
+            if is_numeric_dtype(df[col])
+        ]
+        zone_codes, zones = pd.MultiIndex.from_arrays(
+            [df["TypeZone"].astype(str), df["Zone"].astype(str)]
+        ).factorize()
+        filiere_codes, filieres = pd.factorize(df["Filière"].astype(str))
+        self.annees = np.sort(df["annee"].unique())
+        annee_codes = np.searchsorted(self.annees, df["annee"])
+
+        self.zones = np.asarray(zones.get_level_values(1), dtype=object)
+        self.filieres = np.asarray(filieres, dtype=object)
+        self._zones = {key: code for code, key in enumerate(zones)}
+        self._zones_by_type = {}
+        for code, (type_zone, _) in enumerate(zones):
+            self._zones_by_type.setdefault(type_zone, []).append(code)
+        self._filieres = {key: code for code, key in enumerate(self.filieres)}
+        self._annees = {key: code for code, key in enumerate(self.annees.tolist())}
+        self._indicateurs = {key: code for code, key in enumerate(self.indicateurs)}
+
+        shape = (len(self.zones), len(self.filieres), len(self.annees))
+        self.data = np.full(shape + (len(self.indicateurs),), np.nan)
+        self.data[zone_codes, filiere_codes, annee_codes] = df[
+            self.indicateurs
+        ].to_numpy(dtype=float)
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[zone_codes, filiere_codes, annee_codes] = True
+
+    def _zone_codes(self, type_zone, zone):
+        if isinstance(zone, slice):
+            return np.asarray(self._zones_by_type.get(type_zone, []), dtype=np.intp)
+        if _is_list(zone):
+            return _codes(self._zones, [(type_zone, z) for z in zone])
+        return np.asarray([self._zones[(type_zone, zone)]], dtype=np.intp)
+
+    def select(
+        self,
+        type_zone,
+        zone,
+        filiere=slice(None),
+        annee=slice(None),
+        indicateur=slice(None),
+    ):
+        """
+        Sélectionne un ou plusieurs indicateurs, comme DataFrame.loc[(type_zone, zone, filiere, annee), indicateur]
+
+        Args:
+            type_zone: str, (Régions, Départements ou Epci)
+            zone: liste ou valeur (slice(None): toutes les zones du type)
+            filiere: liste ou valeur (default: toutes)
+            annee: liste ou valeur (default: tous)
+            indicateur: liste ou valeur (default: tous)
+
+        Returns: DataFrame (Series pour un seul indicateur) avec les lignes existantes
+
+        Raises: KeyError si aucune ligne ne correspond
+        """
+        zones = self._zone_codes(type_zone, zone)
+        filieres = _codes(self._filieres, filiere)
+        annees = _codes(self._annees, annee)
+        indicateurs = _codes(self._indicateurs, indicateur)
+
+        present = self.present[np.ix_(zones, filieres, annees)]
+        if not present.any():
+            raise KeyError((type_zone, zone, filiere, annee))
+        z, f, a = np.nonzero(present)
+        values = self.data[
+            zones[z][:, None],
+            filieres[f][:, None],
+            annees[a][:, None],
+            indicateurs[None, :],
+        ]
+        index = pd.MultiIndex.from_arrays(
+            [
+                np.full(len(z), type_zone, dtype=object),
+                self.zones[zones[z]],
+                self.filieres[filieres[f]],
+                self.annees[annees[a]],
+            ],
+            names=self.index_names,
+        )
+        columns = [self.indicateurs[i] for i in indicateurs]
+        frame = pd.DataFrame(values, index=index, columns=columns)
+        if isinstance(indicateur, str):
+            return frame[indicateur]
+        return frame
+
+    def sum(self, type_zone, zone, filiere, annee, indicateur):
+        """
+        Somme d'un indicateur sur la sélection, sans construire de DataFrame (tuiles de la page d'accueil)
+
+        Returns: float, ou None s'il n'y a pas de donnée
+        """
+        try:
+            zones = self._zone_codes(type_zone, zone)
+            filieres = _codes(self._filieres, filiere)
+            annees = _codes(self._annees, annee)
+        except KeyError:
+            return None
+        selection = np.ix_(zones, filieres, annees)
+        if not self.present[selection].any():
+            return None
+        return float(np.nansum(self.data[selection + (self._indicateurs[indicateur],)]))
+
+
+def _is_list(key):
+    return isinstance(key, (list, np.ndarray, pd.Index, pd.Series))
+
+
+def _codes(mapping, key):
+    """
+    Codes des valeurs demandées : toutes pour slice(None), celles qui existent pour une liste, KeyError pour une
+    valeur seule qui n'existe pas (comme DataFrame.loc)
+    """
+    if isinstance(key, slice):
+        return np.arange(len(mapping))
+    if _is_list(key):
+        return np.asarray([mapping[k] for k in key if k in mapping], dtype=np.intp)
+    return np.asarray([mapping[key]], dtype=np.intp)
@@ -0,0 +1,81 @@
+__doc__ = """Exports des tableaux affichés (CSV, Parquet, et GeoPackage / GeoJSON pour les installations), produits
+seulement quand l'utilisateur clique sur le bouton et gardés en cache par sélection"""
+
+import io
+import os
+import tempfile
+from pathlib import Path
+
+import streamlit as st
+
+from enr_app.store import RenderCache
+from enr_app.timing import timed
+
+# Format: (type MIME, géographique)
+export_formats = {
+    "csv": ("text/csv", False),
+    "parquet": ("application/vnd.apache.parquet", False),
+    "gpkg": ("application/geopackage+sqlite3", True),
+    "geojson": ("application/geo+json", True),
+}
+
+export_cache = RenderCache(int(os.environ.get("ENR_EXPORT_CACHE_SIZE", 16)), "exports")
+
+
+@timed
+def export_data(df, fmt):
+    """
+    Sérialise le tableau dans le format demandé. Pour les formats géographiques, les coordonnées x, y deviennent la
+    géométrie (voir installations_geometry), elles ne sont pas exportées dans les autres formats
+
+    Args:
+        df: DataFrame
+        fmt: str, format (csv, parquet, gpkg ou geojson)
+
+    Returns: bytes ou str
+    """
+    if not export_formats[fmt][1]:
+        df = df.drop(columns=["x", "y"], errors="ignore")
+        if fmt == "csv":
+            return df.to_csv(index=False)
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    from enr_app.installations import (  # geopandas, seulement pour ces formats
+        installations_geometry,
+    )
+
+    gdf = installations_geometry(df)
+    if fmt == "geojson":
+        return gdf.to_json(drop_id=True, default=str)
+    categories = gdf.select_dtypes("category").columns
+    gdf = gdf.astype({col: str for col in categories})
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, "export.gpkg")
+        gdf.to_file(path, driver="GPKG")
+        return path.read_bytes()
+
+
+def export_buttons(df, file_name, key, formats=("csv", "parquet")):
+    """
+    Boutons d'export, un par format. Le fichier n'est produit qu'au clic, puis gardé en cache avec la clé de la
+    sélection : l'affichage de la page ne dépend pas de la taille du tableau
+
+    Args:
+        df: DataFrame
+        file_name: str, nom du fichier sans extension
+        key: tuple, identifie la sélection (page, zone, filières...)
+        formats: formats proposés (default: csv et parquet)
+
+    Returns: None
+    """
+    for col, fmt in zip(st.columns(len(formats)), formats):
+        col.download_button(
+            f"Exporter au format {fmt}",
+            data=lambda fmt=fmt: export_cache.get(
+                (key, fmt), lambda: export_data(df, fmt)
+            ),
+            file_name=f"{file_name}.{fmt}",
+            mime=export_formats[fmt][0],
+            key=f"export_{file_name}_{fmt}",
+        )
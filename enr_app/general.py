@@ -1,19 +1,31 @@
 __doc__ = """Fonctions, elements (barre laterale, données, sélections) et définitions
 globales pour l'application"""
 
+import json
 import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
 
-import geopandas as gpd
 import pandas as pd
-import s3fs
 import streamlit as st
 
+from enr_app.cube import IndicateurCube
+from enr_app.store import store
+from enr_app.timing import timed
+from enr_app.zones import ZoneTree, load_snapshot
+
 # Defaults
 region_default = "Toutes"
 departement_default = "Tous"
 epci_default = "Tous"
-# TODO: récupérer depuis fichier avec données
-# N.B.: il faut que ce soit en ordre alphabétique pour que les couleurs et markers correspondent
+# Filières par défaut, quand app_data.gpkg n'a pas été produit (voir get_filieres), dans l'ordre des styles
+# (couleurs, symboles...) : les autres filières prennent les styles suivants (voir filiere_styles)
 filieres = [
     "Eolien",
     "Injection de biométhane",
@@ -21,13 +33,70 @@ filieres = [
     "Photovoltaïque",
 ]
 
-icon_colors = {
-    "Eolien": "blue",
-    "Injection de biométhane": "orange",
-    "Méthanisation électrique": "green",
-    "Photovoltaïque": "red",
+# Index des indicateurs, encodés en catégories (sauf l'année, en entier)
+indicateurs_index = ["TypeZone", "Zone", "Filière", "annee"]
+indicateurs_dtypes = {
+    "TypeZone": "category",
+    "Zone": "category",
+    "Filière": "category",
+    "annee": "int16",
 }
 
+# Couches prêtes à l'emploi produites par enr_app.build, lues seulement si la version du format correspond
+artifact_name = "app_data.gpkg"
+artifact_version = 1
+
+# Indicateurs numériques affichés par les pages, chargés colonne par colonne (voir load_indicateur)
+indicateurs_pages = ["puiss_MW", "energie_GWh", "Nombre de sites"]
+
+# Moteur pour select_indicateur : "pandas" (MultiIndex) ou "cube" (tableau NumPy dense, voir enr_app.cube)
+indicateurs_engine = os.environ.get("ENR_INDICATEURS_ENGINE", "pandas")
+# Fichier des indicateurs : indicateurs.parquet (produit depuis indicateurs.csv) ou indicateurs_installations.parquet
+# (calculés depuis les installations, voir enr_app.aggregation)
+indicateurs_file = os.environ.get("ENR_INDICATEURS_FILE", "indicateurs.parquet")
+
+# Styles par filière, dans l'ordre de filieres puis pour les autres filières (voir filiere_styles)
+# colors from category10 in https://vega.github.io/vega/docs/schemes/#categorical
+colors = [
+    "#1f77b4",
+    "#ff7f0e",
+    "#2ca02c",
+    "#d62728",
+    "#9467bd",
+    "#8c564b",
+    "#e377c2",
+    "#7f7f7f",
+    "#bcbd22",
+    "#17becf",
+]
+# https://vega.github.io/vega/docs/marks/symbol/
+markers = [
+    "circle",
+    "square",
+    "triangle",
+    "cross",
+    "diamond",
+    "triangle-down",
+    "triangle-right",
+    "triangle-left",
+    "wedge",
+    "arrow",
+]
+# Couleurs des marqueurs folium (folium.Icon)
+icon_colors = [
+    "blue",
+    "orange",
+    "green",
+    "red",
+    "purple",
+    "darkred",
+    "pink",
+    "gray",
+    "lightgreen",
+    "lightblue",
+]
+emojis = ["🟦", "🟧", "🟩", "🟥", "🟪", "🟫", "⬜", "⬛", "🟨"]
+
 sources = {
     "ODRÉ": "ODRÉ [[1]](https://odre.opendatasoft.com/explore/dataset/registre-national-installation-production-stockage-electricite-agrege-311220/information/?disjunctive.epci&disjunctive.departement&disjunctive.region&disjunctive.filiere&disjunctive.combustible&disjunctive.combustiblessecondaires&disjunctive.technologie&disjunctive.regime&disjunctive.gestionnaire) [[2]](https://odre.opendatasoft.com/explore/dataset/points-dinjection-de-biomethane-en-france/information/?disjunctive.site&disjunctive.nom_epci&disjunctive.departement&disjunctive.region&disjunctive.type_de_reseau&disjunctive.grx_demandeur) [[3]](https://opendata.reseaux-energies.fr/explore/dataset/injection-annuelle-biomethane-pitp-grtgaz)",  # noqa: E501
     "ODRÉ_gaz": "ODRÉ [[1]](https://odre.opendatasoft.com/explore/dataset/points-dinjection-de-biomethane-en-france/information/?disjunctive.site&disjunctive.nom_epci&disjunctive.departement&disjunctive.region&disjunctive.type_de_reseau&disjunctive.grx_demandeur) [[2]](https://opendata.reseaux-energies.fr/explore/dataset/injection-annuelle-biomethane-pitp-grtgaz)",  # noqa: E501
@@ -79,10 +148,95 @@ def remove_page_items(menu=True, footer=True):
         )
 
 
+# Copie locale des fichiers sur S3, par version (ETag), revalidée au plus toutes les cache_ttl secondes
+cache_dir = Path(
+    os.environ.get("ENR_CACHE_DIR", Path(tempfile.gettempdir(), "enr_app"))
+)
+cache_ttl = float(os.environ.get("ENR_CACHE_TTL", 60))
+s3_bucket = "projet-connaissance-enr"
+_etags = {}  # filename: (ETag, instant de la dernière validation)
+_cache_locks = {}
+
+
+@lru_cache(maxsize=None)
+def get_filesystem():
+    """
+    Returns: s3fs.S3FileSystem, un seul par processus
+    """
+    import s3fs  # seulement avec $AWS_S3_ENDPOINT
+
+    S3_ENDPOINT_URL = "https://" + os.environ["AWS_S3_ENDPOINT"]
+    return s3fs.S3FileSystem(client_kwargs={"endpoint_url": S3_ENDPOINT_URL})
+
+
+def file_version(filename):
+    """
+    Version actuelle d'un fichier de données : ETag sur S3 (sans cache), date de modification et taille en local
+
+    Args:
+        filename (str): file name
+
+    Returns:
+        str, version (None si le fichier n'existe pas)
+    """
+    if "AWS_S3_ENDPOINT" not in os.environ:
+        try:
+            stat = os.stat(f"data/{filename}")
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    try:
+        info = get_filesystem().info(f"{s3_bucket}/{filename}", refresh=True)
+    except FileNotFoundError:
+        return None
+    etag = re.sub(r"[^0-9A-Za-z-]", "", info["ETag"])
+    _etags[filename] = (etag, time.monotonic())
+    return etag
+
+
+def local_path(filename):
+    """
+    Return the local path of a data file: data/<filename>, or, if environment variable $AWS_S3_ENDPOINT is set, a
+    copy of projet-connaissance-enr/<filename> in cache_dir/<ETag>/. The copy is downloaded once per version and
+    its ETag is checked again on S3 at most every cache_ttl seconds
+
+    Args:
+        filename (str): file name
+
+    Returns:
+        str, local path
+    """
+    if "AWS_S3_ENDPOINT" not in os.environ:
+        store.add_file(filename, file_version(filename))
+        return f"data/{filename}"
+    with _cache_locks.setdefault(filename, threading.Lock()):
+        etag, checked = _etags.get(filename, (None, 0.0))
+        if etag is None or time.monotonic() - checked > cache_ttl:
+            etag = file_version(filename)
+        store.add_file(filename, etag)
+        if etag is None:
+            raise FileNotFoundError(f"{s3_bucket}/{filename}")
+        path = cache_dir / etag / filename
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{filename}.{os.getpid()}.tmp")
+            get_filesystem().get(f"{s3_bucket}/{filename}", str(tmp))
+            os.replace(tmp, path)
+            for old in cache_dir.glob(f"*/{filename}"):  # anciennes versions
+                if old != path:
+                    old.unlink(missing_ok=True)
+                    try:
+                        old.parent.rmdir()
+                    except OSError:  # d'autres fichiers dans la même version
+                        pass
+    return str(path)
+
+
 def open_file(filename, mode="r"):
     """
-    Return a file object, open with open(data/<filename>, <mode>) or fs.open(projet-connaissance-enr/filename, <mode>)
-    for s3, depending if environment variable $AWS_S3_ENDPOINT is set
+    Return a file object, open with open(data/<filename>, <mode>) or, if environment variable $AWS_S3_ENDPOINT is
+    set, with open(<local copy of projet-connaissance-enr/filename>, <mode>) for reading and
+    fs.open(projet-connaissance-enr/filename, <mode>) for writing (see local_path)
 
     Args:
         filename (str): file to open
@@ -91,31 +245,71 @@ def open_file(filename, mode="r"):
     Returns:
         File object
     """
-    if "AWS_S3_ENDPOINT" in os.environ:
-        # Create filesystem object
-        S3_ENDPOINT_URL = "https://" + os.environ["AWS_S3_ENDPOINT"]
-        fs = s3fs.S3FileSystem(client_kwargs={"endpoint_url": S3_ENDPOINT_URL})
-        return fs.open(f"projet-connaissance-enr/{filename}", mode=mode)
-    else:
-        return open(f"data/{filename}", mode=mode)
+    if "AWS_S3_ENDPOINT" in os.environ and "r" not in mode:
+        return get_filesystem().open(f"{s3_bucket}/{filename}", mode=mode)
+    return open(local_path(filename), mode=mode)
 
 
-@st.cache
-def load_zones():  # FIXME
-    regions = pd.read_json("https://geo.api.gouv.fr/regions").rename(
+@store.dataset
+def load_metadata():
+    """
+    Métadonnées de app_data.gpkg (table "metadata", lue sans geopandas), voir enr_app.build et enr_app.artifact
+
+    Returns: dict, ou None si le fichier n'a pas été produit ou est d'une autre version du format
+    """
+    try:
+        path = local_path(artifact_name)
+    except FileNotFoundError:  # absent du S3
+        return None
+    if not os.path.exists(path):  # absent de data/
+        return None
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as con:
+        try:
+            rows = con.execute("SELECT key, value FROM metadata").fetchall()
+        except sqlite3.DatabaseError:
+            return None
+    metadata = {key: json.loads(value) for key, value in rows}
+    if metadata.get("format_version") != artifact_version:
+        return None
+    return metadata
+
+
+def get_filieres():
+    """
+    Returns: liste des filières (ordre alphabétique), lue dans app_data.gpkg s'il a été produit
+    """
+    metadata = load_metadata()
+    return filieres if metadata is None else metadata["filieres"]
+
+
+def filiere_styles(styles, liste_filieres=()):
+    """
+    Style de chaque filière : les filières par défaut gardent toujours le même style, les autres (lues dans
+    app_data.gpkg ou dans les données) prennent les styles suivants, en boucle
+
+    Args:
+        styles: liste de styles (colors, markers, icon_colors ou emojis)
+        liste_filieres: filières en plus de get_filieres() (default: aucune)
+
+    Returns: dict {filière: style}
+    """
+    others = sorted(set(get_filieres()).union(liste_filieres) - set(filieres))
+    return {fil: styles[i % len(styles)] for i, fil in enumerate(filieres + others)}
+
+
+@store.dataset
+def load_zones():
+    regions, departements, _ = load_snapshot()
+    regions = regions.rename(columns={"nom": "Zone", "code": "CodeZone"})
+    departements = departements.rename(
         columns={"nom": "Zone", "code": "CodeZone"}
-    )
-    departements = (
-        pd.read_json("https://geo.api.gouv.fr/departements")
-        .rename(columns={"nom": "Zone", "code": "CodeZone"})
-        .merge(
-            regions.rename(columns={"Zone": "Region", "CodeZone": "codeRegion"}),
-            on="codeRegion",
-        )
+    ).merge(
+        regions.rename(columns={"Zone": "Region", "CodeZone": "codeRegion"}),
+        on="codeRegion",
     )
     with open_file("epcis.csv") as file_in:
         epcis = (
-            pd.read_csv(file_in)
+            pd.read_csv(file_in, dtype={"DEPARTEMENTS_DE_L_EPCI": str})
             .merge(
                 departements.rename(columns={"Zone": "Departement"}),
                 left_on="DEPARTEMENTS_DE_L_EPCI",
@@ -136,42 +330,59 @@ def load_zones():  # FIXME
     return zones
 
 
-@st.cache
-def load_installations():
-    with open_file("app.gpkg", "rb") as file_in:
-        return gpd.read_file(file_in, layer="installations")
+@store.dataset
+def load_zone_tree():
+    return ZoneTree(load_zones())
 
 
-@st.cache
-def load_installations_biogaz():
-    with open_file("installations.gpkg", "rb") as file_in:
-        return (
-            gpd.read_file(file_in, layer="installations_biogaz")
-            .to_crs(epsg=4326)
-            .rename(
-                columns={
-                    "nom_du_projet": "nominstallation",
-                    "date_de_mes": "date_inst",
-                    "quantite_annuelle_injectee_en_mwh": "prod_MWh_an",
-                    "type": "typo",
-                }
-            )
-            .assign(
-                Filière="Injection de biométhane",
-                puiss_MW=lambda x: x["capacite_de_production_gwh_an"]
-                / (365 * 24)
-                * 1e3,
-                energie_GWh=lambda x: x["prod_MWh_an"] * 1e-3,
+@timed
+def read_indicateurs(colonnes=None):
+    """
+    Lit les indicateurs depuis indicateurs_file (seulement les colonnes demandées), ou depuis indicateurs.csv
+    si le fichier parquet n'a pas été produit (voir enr_app.build et enr_app.aggregation)
+
+    Args:
+        colonnes: liste des indicateurs à lire (default: None, tous)
+
+    Returns: DataFrame avec index (TypeZone, Zone, Filière, annee)
+    """
+    columns = None if colonnes is None else indicateurs_index + list(colonnes)
+    try:
+        with open_file(indicateurs_file, "rb") as file_in:
+            indicateurs = pd.read_parquet(file_in, columns=columns)
+    except FileNotFoundError:
+        with open_file("indicateurs.csv") as file_in:
+            indicateurs = pd.read_csv(file_in, usecols=columns).astype(
+                indicateurs_dtypes
             )
-        )
+    return indicateurs.set_index(indicateurs_index)
 
 
-@st.cache
+@store.dataset
 def load_indicateurs():
-    with open_file("indicateurs.csv") as file_in:
-        return pd.read_csv(file_in).set_index(["TypeZone", "Zone", "Filière", "annee"])
+    return read_indicateurs()
 
 
+def load_indicateur(indicateur):
+    """
+    Un seul indicateur, chargé une seule fois : la mémoire utilisée dépend des indicateurs affichés par les pages
+
+    Args:
+        indicateur: str, nom de la colonne
+
+    Returns: DataFrame avec index (TypeZone, Zone, Filière, annee) et une colonne
+    """
+    return store.get(
+        f"indicateurs[{indicateur}]", lambda: read_indicateurs([indicateur])
+    )
+
+
+@store.dataset
+def load_cube_indicateurs():
+    return IndicateurCube(load_indicateurs())
+
+
+@timed
 def select_zone():
     """
     Sélectionne le territoire (région, département, EPCI) à travers 3 menus déroulants
@@ -186,9 +397,8 @@ def select_zone():
     def on_change_department():
         st.session_state["EPCI"] = epci_default
 
-    liste_regions = [region_default] + load_zones().set_index("TypeZone").loc[
-        "Régions", "Zone"
-    ].to_list()
+    zone_tree = load_zone_tree()
+    liste_regions = [region_default] + zone_tree.regions
     if "region" not in st.session_state:
         st.session_state["region"] = region_default
         index = 0
@@ -202,15 +412,9 @@ def select_zone():
     reg = (
         st.session_state["region"]
         if st.session_state["region"] != region_default
-        else slice(None)
-    )
-    liste_departements = (
-        load_zones()
-        .set_index(["TypeZone", "Region"])
-        .loc[("Départements", reg), "Zone"]
-        .to_list()
+        else None
     )
-    liste_departements = [departement_default] + liste_departements
+    liste_departements = [departement_default] + zone_tree.departements(reg)
     if "departement" not in st.session_state:
         st.session_state["departement"] = departement_default
         index = 0
@@ -227,16 +431,9 @@ def select_zone():
     dep = (
         st.session_state["departement"]
         if st.session_state["departement"] != departement_default
-        else slice(None)
+        else None
     )
-    try:
-        liste_epcis = [epci_default] + load_zones().set_index(
-            ["TypeZone", "Region", "Departement"]
-        ).loc[("Epci", reg, dep), "Zone"].drop_duplicates().to_list()
-    except KeyError:
-        liste_epcis = [epci_default] + load_zones().set_index("TypeZone").loc[
-            "Epci", "Zone"
-        ].to_list()
+    liste_epcis = [epci_default] + zone_tree.epcis(reg, dep)
 
     if "EPCI" not in st.session_state:
         st.session_state["EPCI"] = epci_default
@@ -257,6 +454,7 @@ def select_zone():
     return st.session_state["TypeZone"], st.session_state["Zone"]
 
 
+@timed
 def select_filieres():
     """
     Sélectionne les filières à considérer avec une checkbox par filière
@@ -264,37 +462,15 @@ def select_filieres():
     Returns: un dictionnaire avec filière, True/False
     """
     st.sidebar.write("Filières")
-    values = {x: st.session_state.get(x, True) for x in filieres}
-    emojis = ["🟦", "🟧", "🟩", "🟥"]
+    values = {x: st.session_state.get(x, True) for x in get_filieres()}
+    styles = filiere_styles(emojis)
     st.session_state["filieres"] = {
-        k: st.sidebar.checkbox(f"{e} {k}", v, key=k)
-        for e, (k, v) in zip(emojis, values.items())
+        k: st.sidebar.checkbox(f"{styles[k]} {k}", v, key=k) for k, v in values.items()
     }
     return [k for k, v in st.session_state["filieres"].items() if v]
 
 
-def select_installations(type_zone, zone, filiere=None):
-    """
-    Sélectionne les installations
-
-    Args:
-        type_zone: str, (Régions, Départements ou Epci)
-        zone: str, nom de la zone
-        filiere: list (default: None)
-
-    Returns: DataFrame avec les installations sélectionnées
-    """
-    installations = load_installations()
-    column = {"Régions": "NOM_REG", "Départements": "NOM_DEP", "Epci": "NOM_EPCI"}[
-        type_zone
-    ]
-    if type_zone != "Régions" or zone != region_default:
-        installations = installations.query(f'{column} == "{zone}"')
-    if len(installations) and filiere is not None:
-        return installations.loc[installations["Filière"].isin(filiere)]
-    return installations
-
-
+@timed
 def select_indicateur(
     type_zone, zone, filiere=slice(None), annee=slice(None), indicateur=slice(None)
 ):
@@ -312,36 +488,60 @@ def select_indicateur(
 
     """
     try:
-        return load_indicateurs().loc[(type_zone, zone, filiere, annee), indicateur]
+        # Le cube ne contient que les indicateurs numériques : toutes les colonnes sont lues avec pandas
+        if indicateurs_engine == "cube" and not isinstance(indicateur, slice):
+            return load_cube_indicateurs().select(
+                type_zone, zone, filiere, annee, indicateur
+            )
+        if isinstance(indicateur, str):
+            indicateurs = load_indicateur(indicateur)
+        elif isinstance(indicateur, list):
+            indicateurs = pd.concat([load_indicateur(x) for x in indicateur], axis=1)
+        else:
+            indicateurs = load_indicateurs()
+        return indicateurs.loc[(type_zone, zone, filiere, annee), indicateur]
     except KeyError:
-        return pd.DataFrame(
-            columns=["TypeZone", "Zone", "Filière", "annee", indicateur], dtype=str
-        )
+        columns = indicateur if isinstance(indicateur, list) else [indicateur]
+        return pd.DataFrame(columns=indicateurs_index + columns, dtype=str)
+
+
+@timed
+def sum_indicateur(type_zone, zone, filiere, annee, indicateur):
+    """
+    Somme d'un indicateur sur les filières sélectionnées
+
+    Args:
+        type_zone: str, (Régions, Départements ou Epci)
+        zone: str, nom de la zone
+        filiere: liste
+        annee: int
+        indicateur: str
+
+    Returns: float, ou None s'il n'y a pas de donnée
+    """
+    if indicateurs_engine == "cube":
+        return load_cube_indicateurs().sum(type_zone, zone, filiere, annee, indicateur)
+    df = select_indicateur(type_zone, zone, filiere, annee, indicateur)
+    return None if df.empty else df.sum()
 
 
 def get_colors(liste_filieres=None):
     """
     Returns: liste de couleurs à utiliser selon les filières sélectionnées, pour garder la même couleur par filière
     """
-    # colors from category10 in https://vega.github.io/vega/docs/schemes/#categorical
-    colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd"]
-    d = (
-        st.session_state["filieres"]
-        if liste_filieres is None
-        else {fil: fil in liste_filieres for fil in filieres}
-    )
-    return [x for fil, x in zip(filieres, colors) if d.get(fil)]
+    return _selected_styles(colors, liste_filieres)
 
 
 def get_markers(liste_filieres=None):
     """
     Returns: liste de symboles à utiliser selon les filières sélectionnées, pour garder le même symbole par filière
     """
-    # https://vega.github.io/vega/docs/marks/symbol/
-    markers = ["circle", "square", "triangle", "cross", "diamond"]
-    d = (
-        st.session_state["filieres"]
-        if liste_filieres is None
-        else {fil: fil in liste_filieres for fil in filieres}
-    )
-    return [x for fil, x in zip(filieres, markers) if d.get(fil)]
+    return _selected_styles(markers, liste_filieres)
+
+
+def _selected_styles(styles, liste_filieres):
+    # Styles des filières sélectionnées, dans l'ordre alphabétique des filières (celui des graphiques)
+    if liste_filieres is None:
+        liste_filieres = [k for k, v in st.session_state["filieres"].items() if v]
+    styles = filiere_styles(styles, liste_filieres)
+    return [styles[fil] for fil in sorted(liste_filieres)]
@@ -0,0 +1,327 @@
+__doc__ = """Installations : chargement, index et sélections par zone, filière et limites de la carte
+
+Seule la page d'accueil (carte, tableau et exports des installations) importe ce module, et donc geopandas et
+shapely : les pages d'indicateurs n'utilisent que pandas (voir enr_app.general)"""
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from enr_app.artifact import layer_source, read_layer
+from enr_app.general import region_default
+from enr_app.store import RenderCache, store
+from enr_app.timing import timed
+
+# Colonnes des installations avec le nom de la zone, par type de zone
+zone_columns = {"Régions": "NOM_REG", "Départements": "NOM_DEP", "Epci": "NOM_EPCI"}
+# Colonnes des installations affichées par l'application
+installations_columns = [
+    "nominstallation",
+    "Filière",
+    "typo",
+    "date_inst",
+    "puiss_MW",
+    "energie_GWh",
+    "NOM_EPCI",
+    "NOM_DEP",
+    "NOM_REG",
+]
+# Colonnes répétitives des installations, encodées en catégories
+installations_categories = ["Filière", "typo", "NOM_EPCI", "NOM_DEP", "NOM_REG"]
+# Lecture des installations : "memory" (couche entière en mémoire, avec index) ou "gpkg" (filtres de zone, filière
+# et limites transmis au GeoPackage, seules les lignes et colonnes utiles sont lues)
+installations_reader = os.environ.get("ENR_INSTALLATIONS_READER", "memory")
+
+
+def compact_installations(installations):
+    """
+    Représentation compacte des installations : catégories pour les colonnes répétitives et coordonnées dans deux
+    tableaux float64 x, y à la place des objets Point (voir installations_geometry)
+
+    Args:
+        installations: GeoDataFrame en EPSG:4326
+
+    Returns: DataFrame sans géométrie, avec les colonnes x (longitude) et y (latitude)
+    """
+    points = installations.geometry.values
+    categories = [col for col in installations_categories if col in installations]
+    return (
+        pd.DataFrame(installations.drop(columns=installations.geometry.name))
+        .astype({col: "category" for col in categories})
+        .assign(
+            x=np.ascontiguousarray(shapely.get_x(points), dtype=np.float64),
+            y=np.ascontiguousarray(shapely.get_y(points), dtype=np.float64),
+        )
+    )
+
+
+def installations_geometry(installations):
+    """
+    Construit les objets Point des installations, seulement pour celles qui sont affichées sur la carte
+
+    Args:
+        installations: DataFrame avec les colonnes x, y (voir compact_installations)
+
+    Returns: GeoDataFrame en EPSG:4326
+    """
+    return gpd.GeoDataFrame(
+        installations.drop(columns=["x", "y"]),
+        geometry=gpd.points_from_xy(installations["x"], installations["y"]),
+        crs="EPSG:4326",
+    )
+
+
+@store.dataset
+def load_installations():
+    return compact_installations(read_layer("installations"))
+
+
+@store.dataset
+def load_installations_biogaz():
+    return read_layer("installations_biogaz")
+
+
+class InstallationsIndex:
+    """
+    Index des positions (iloc) des installations par (type de zone, zone, filière), construit une seule fois.
+    Une sélection coûte O(nombre d'installations sélectionnées), sans parcourir toutes les installations
+    """
+
+    def __init__(self, installations):
+        self.filieres = sorted(installations["Filière"].dropna().unique())
+        self._positions = {
+            ("Régions", region_default, filiere): positions
+            for filiere, positions in installations.groupby(
+                "Filière", sort=False, observed=True
+            ).indices.items()
+        }
+        for type_zone, column in zone_columns.items():
+            groups = installations.groupby(
+                [column, "Filière"], sort=False, observed=True
+            ).indices
+            for (zone, filiere), positions in groups.items():
+                self._positions[(type_zone, zone, filiere)] = positions
+
+    def positions(self, type_zone, zone, filiere=None):
+        """
+        Positions des installations de la zone et des filières choisies
+
+        Args:
+            type_zone: str, (Régions, Départements ou Epci)
+            zone: str, nom de la zone
+            filiere: list (default: None, toutes)
+
+        Returns: array avec les positions triées
+        """
+        if filiere is None:
+            filiere = self.filieres
+        keys = [(type_zone, zone, fil) for fil in filiere]
+        arrays = [self._positions[key] for key in keys if key in self._positions]
+        if not arrays:
+            return np.array([], dtype=np.intp)
+        return np.sort(np.concatenate(arrays))
+
+
+@store.dataset
+def load_index_installations():
+    return InstallationsIndex(load_installations())
+
+
+def _sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+@timed
+def read_installations(type_zone, zone, filiere=None, bbox=None):
+    """
+    Lit les installations depuis le GeoPackage en y appliquant les filtres : seules les lignes de la zone, des
+    filières et des limites demandées sont lues (index spatial du GeoPackage), avec les colonnes
+    installations_columns
+
+    Args:
+        type_zone: str, (Régions, Départements ou Epci)
+        zone: str, nom de la zone
+        filiere: list (default: None, toutes)
+        bbox: tuple (minx, miny, maxx, maxy) (default: None)
+
+    Returns: DataFrame compact (voir compact_installations)
+    """
+    clauses = []
+    if type_zone != "Régions" or zone != region_default:
+        clauses.append(f'"{zone_columns[type_zone]}" = {_sql_string(zone)}')
+    if filiere is not None:
+        clauses.append(
+            f'"Filière" IN ({", ".join(map(_sql_string, filiere))})'
+            if len(filiere)
+            else "0"
+        )
+    path, layer = layer_source("installations")
+    return compact_installations(
+        gpd.read_file(
+            path,
+            layer=layer,
+            engine="pyogrio",
+            columns=installations_columns,
+            where=" AND ".join(clauses) or None,
+            bbox=bbox,
+        )
+    )
+
+
+# Lectures du GeoPackage par génération des données, zone et filières (ENR_INSTALLATIONS_READER=gpkg), bornées
+# en mémoire ($ENR_ZONE_CACHE_MB) : ce lecteur sert à ne pas garder toutes les installations en mémoire
+zone_cache = RenderCache(
+    32,
+    "installations_zones",
+    maxbytes=int(float(os.environ.get("ENR_ZONE_CACHE_MB", 64)) * 2**20),
+)
+# Toute la France dépasserait la limite de zone_cache : une seule sélection nationale est gardée à part, pour que
+# chaque exécution de la page d'accueil au niveau national ne relise pas toute la couche
+national_cache = RenderCache(1, "installations_france")
+
+
+def _read_installations_zone(type_zone, zone, filiere):
+    def read():
+        return read_installations(
+            type_zone, zone, None if filiere is None else list(filiere)
+        )
+
+    if type_zone == "Régions" and zone == region_default:
+        return national_cache.get(filiere, read)
+    return zone_cache.get((type_zone, zone, filiere), read)
+
+
+class GridIndex:
+    """
+    Index des installations sur une grille régulière (environ points_per_cell installations par cellule), sans
+    objets géométriques : les positions sont triées par cellule, ligne par ligne, si bien qu'une sélection par
+    limites lit une tranche contiguë par ligne de cellules touchée, puis filtre les coordonnées des seules
+    installations de ces cellules
+    """
+
+    points_per_cell = 16
+
+    def __init__(self, x, y):
+        """
+        Args:
+            x: array des longitudes
+            y: array des latitudes (NaN : installation jamais sélectionnée)
+        """
+        self._x = x
+        self._y = y
+        valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        n = max(int(np.sqrt(len(valid) / self.points_per_cell)), 1)
+        self._shape = (min(n, 1024), min(n, 1024))
+        if len(valid):
+            self._origin = (x[valid].min(), y[valid].min())
+            self._size = (
+                max((x[valid].max() - self._origin[0]) / self._shape[1], 1e-9),
+                max((y[valid].max() - self._origin[1]) / self._shape[0], 1e-9),
+            )
+        else:
+            self._origin, self._size = (0.0, 0.0), (1.0, 1.0)
+        cells = self._cells(x[valid], y[valid])
+        order = np.argsort(cells, kind="stable")
+        self._positions = valid[order]
+        # Début de chaque cellule dans _positions (une cellule de plus pour la fin)
+        self._starts = np.r_[
+            0, np.cumsum(np.bincount(cells, minlength=self._shape[0] * self._shape[1]))
+        ]
+
+    def _index(self, values, axis):
+        # Colonne (axis=1) ou ligne (axis=0) des cellules, bornée à la grille
+        origin = self._origin[1 - axis]
+        index = np.floor((np.asarray(values) - origin) / self._size[1 - axis])
+        return np.clip(index, 0, self._shape[axis] - 1).astype(np.int64)
+
+    def _cells(self, x, y):
+        return self._index(y, 0) * self._shape[1] + self._index(x, 1)
+
+    def query(self, bounds):
+        """
+        Args:
+            bounds: tuple (minx, miny, maxx, maxy)
+
+        Returns: array avec les positions triées des installations dans les limites
+        """
+        minx, miny, maxx, maxy = bounds
+        col0, col1 = self._index([minx, maxx], 1)
+        row0, row1 = self._index([miny, maxy], 0)
+        rows = np.arange(row0, row1 + 1) * self._shape[1]
+        candidates = np.concatenate(
+            [
+                self._positions[self._starts[r + col0] : self._starts[r + col1 + 1]]
+                for r in rows
+            ]
+        )
+        x = self._x[candidates]
+        y = self._y[candidates]
+        inside = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+        return np.sort(candidates[inside])
+
+
+@store.dataset
+def load_bbox_index_installations():
+    installations = load_installations()
+    return GridIndex(installations["x"].to_numpy(), installations["y"].to_numpy())
+
+
+@timed
+def select_installations(type_zone, zone, filiere=None):
+    """
+    Sélectionne les installations
+
+    Args:
+        type_zone: str, (Régions, Départements ou Epci)
+        zone: str, nom de la zone
+        filiere: list (default: None)
+
+    Returns: DataFrame avec les installations sélectionnées
+    """
+    if type_zone not in zone_columns:
+        raise ValueError(f"Invalid type_zone: {type_zone}")
+    if installations_reader == "gpkg":  # en cache par zone et filières
+        return _read_installations_zone(
+            type_zone, zone, None if filiere is None else tuple(filiere)
+        ).copy(deep=False)
+    positions = load_index_installations().positions(type_zone, zone, filiere)
+    return load_installations().iloc[positions]
+
+
+@timed
+def select_installations_in_bounds(type_zone, zone, filiere, bounds, budget):
+    """
+    Sélectionne les installations de la zone visibles sur la carte, à travers l'index par coordonnées
+
+    Args:
+        type_zone: str, (Régions, Départements ou Epci)
+        zone: str, nom de la zone
+        filiere: list
+        bounds: tuple (minx, miny, maxx, maxy), limites de la carte en degrés
+        budget: int, nombre maximum d'installations retournées (les plus puissantes)
+
+    Returns: DataFrame avec les installations sélectionnées, nombre d'installations visibles
+    """
+    if type_zone not in zone_columns:
+        raise ValueError(f"Invalid type_zone: {type_zone}")
+    if installations_reader == "gpkg":
+        visibles = read_installations(type_zone, zone, filiere, bbox=tuple(bounds))
+        if len(visibles) > budget:
+            return visibles.nlargest(budget, "puiss_MW").sort_index(), len(visibles)
+        return visibles, len(visibles)
+    installations = load_installations()
+    positions = load_bbox_index_installations().query(bounds)
+    visible = installations.iloc[positions]
+    mask = visible["Filière"].isin(filiere).to_numpy()
+    if type_zone != "Régions" or zone != region_default:
+        mask = mask & (visible[zone_columns[type_zone]] == zone).to_numpy()
+    positions = positions[mask]
+    n_visible = len(positions)
+    if n_visible > budget:
+        puissance = installations["puiss_MW"].to_numpy(dtype=float)[positions]
+        order = np.argsort(-np.nan_to_num(puissance), kind="stable")
+        positions = np.sort(positions[order[:budget]])
+    return installations.iloc[positions], n_visible
@@ -1,28 +1,90 @@
 __doc__ = "Fonctions pour produire une carte des installations"
 
+import os
+
 import folium
 import geopandas as gpd
-import streamlit as st
+import numpy as np
+import pandas as pd
+import shapely
 
-from enr_app.general import load_zones, open_file, region_default
+from enr_app.artifact import read_layer
+from enr_app.general import (
+    colors,
+    filiere_styles,
+    icon_colors,
+    load_zones,
+    region_default,
+)
+from enr_app.installations import installations_geometry, select_installations
+from enr_app.store import RenderCache, store
+from enr_app.timing import timed
 
 
-@st.cache
+@store.dataset
 def load_contour_regions():
-    with open_file("app.gpkg", "rb") as file_in:
-        return gpd.read_file(file_in, layer="regions").to_crs(epsg=4326)
+    return read_layer("regions")
 
 
-@st.cache
+@store.dataset
 def load_contour_departements():
-    with open_file("app.gpkg", "rb") as file_in:
-        return gpd.read_file(file_in, layer="departements").to_crs(epsg=4326)
+    return read_layer("departements")
 
 
-@st.cache
+@store.dataset
 def load_contour_EPCIs():
-    with open_file("app.gpkg", "rb") as file_in:
-        return gpd.read_file(file_in, layer="EPCIs").to_crs(epsg=4326)
+    return read_layer("EPCIs")
+
+
+# Tolérance de simplification des contours (en degrés) selon le zoom de la carte, environ un demi-pixel
+simplify_tolerances = {5: 0.02, 6: 0.01, 7: 0.005, 8: 0.0025}
+
+
+def simplify_contours(contour):
+    """
+    Simplifie les contours pour chaque zoom de simplify_tolerances. Les frontières communes sont préservées avec
+    shapely.coverage_simplify (shapely >= 2.1), sinon chaque polygone est simplifié en gardant sa topologie
+
+    Args:
+        contour: GeoDataFrame
+
+    Returns: dictionnaire {zoom: GeoDataFrame simplifié}
+    """
+    # Arrondi (~10 cm) pour que les frontières communes soient identiques et reconnues comme telles
+    geometry = shapely.set_precision(np.asarray(contour.geometry.values), 1e-6)
+    simplified = {}
+    for zoom, tolerance in simplify_tolerances.items():
+        try:
+            simple = shapely.coverage_simplify(geometry, tolerance)
+        except (AttributeError, shapely.errors.GEOSException):
+            simple = shapely.simplify(geometry, tolerance, preserve_topology=True)
+        simplified[zoom] = contour.set_geometry(
+            gpd.GeoSeries(simple, index=contour.index, crs=contour.crs)
+        )
+    return simplified
+
+
+# Taille des cellules (en degrés) pour regrouper les installations, selon le zoom de la carte
+grid_sizes = {5: 0.5, 6: 0.2, 7: 0.1, 8: 0.05}
+# Au-delà, les installations sont regroupées même pour un département ou un EPCI
+max_markers = 1000
+# Intensité des cellules de la grille : colonne de aggregate_installations et libellé
+grid_shadings = {"n": "Nombre d'installations", "puiss_MW": "Puissance (MW)"}
+
+
+@store.dataset
+def load_contour_regions_simplifiees():
+    return simplify_contours(load_contour_regions())
+
+
+@store.dataset
+def load_contour_departements_simplifiees():
+    return simplify_contours(load_contour_departements())
+
+
+@store.dataset
+def load_contour_EPCIs_simplifiees():
+    return simplify_contours(load_contour_EPCIs())
 
 
 def get_zoom(type_zone, zone):
@@ -44,31 +106,176 @@ def get_zoom(type_zone, zone):
     return 5
 
 
-def get_map(type_zone, zone):
+def get_contour(type_zone, zone):
+    """
+    Contour de la zone, simplifié selon le zoom de la carte
+
+    Args:
+        type_zone: str ('Epci', 'Départements', 'Régions')
+        zone: str
+
+    Returns: GeoDataFrame
+    """
+    zoom = get_zoom(type_zone, zone)
     if type_zone == "Régions" and zone == region_default:
-        contour = load_contour_regions().query("REG > '10'")
+        contour = load_contour_regions_simplifiees()[zoom]
+        contour = contour.loc[contour["REG"] > "10"]
     elif type_zone == "Régions":
-        contour = load_contour_regions().query(f'NOM_REG == "{zone}"')
-        # location = [contour_zone.centroid.y, contour_zone.centroid.x]
+        contour = load_contour_regions_simplifiees()[zoom]
+        contour = contour.loc[contour["NOM_REG"] == zone]
     elif type_zone == "Départements":
-        contour = load_contour_departements().query(f'NOM_DEP == "{zone}"')
-        # location = [contour_zone.centroid.y, contour_zone.centroid.x]
+        contour = load_contour_departements_simplifiees()[zoom]
+        contour = contour.loc[contour["NOM_DEP"] == zone]
     elif type_zone == "Epci":
-        contour = load_contour_EPCIs().query(f'Zone == "{zone}"')
-        if not len(contour):  # FIXME: entrées manquantes ?
-            dep = (
-                load_zones()
-                .set_index(["TypeZone", "Zone"])
-                .loc[(type_zone, zone), "Departement"]
-                .values[0]
-            )
-            contour = load_contour_departements().query(f'NOM_DEP == "{dep}"')
+        contour = load_contour_EPCIs_simplifiees()[zoom]
+        contour = contour.loc[contour["Zone"] == zone]
+        if not len(contour):  # EPCI sans contour (voir enr_app.spatial) : département
+            zones = load_zones()
+            dep = zones.loc[
+                (zones["TypeZone"] == type_zone) & (zones["Zone"] == zone),
+                "Departement",
+            ].values[0]
+            contour = load_contour_departements_simplifiees()[zoom]
+            contour = contour.loc[contour["NOM_DEP"] == dep]
     else:
         raise ValueError(f"Invalid type_zone: {type_zone}")
-    location = [
-        contour.geometry.apply(lambda g: g.centroid.y).mean(),
-        contour.geometry.apply(lambda g: g.centroid.x).mean(),
-    ]
+    return contour
+
+
+def _zone_geometries(contour, type_zone, zones):
+    """
+    Centres et limites des zones à partir de leurs contours, calculés en une seule passe vectorisée
+
+    Args:
+        contour: GeoDataFrame en EPSG:4326
+        type_zone: str ('Epci', 'Départements', 'Régions')
+        zones: noms des zones, un par ligne de contour
+
+    Returns: DataFrame avec index (TypeZone, Zone) et colonnes lat, lon, minx, miny, maxx, maxy, zoom
+    """
+    geometry = np.asarray(contour.geometry.values)
+    centroids = shapely.centroid(geometry)
+    bounds = shapely.bounds(geometry)
+    df = (
+        pd.DataFrame(
+            {
+                "TypeZone": type_zone,
+                "Zone": np.asarray(zones),
+                "lat": shapely.get_y(centroids),
+                "lon": shapely.get_x(centroids),
+                "minx": bounds[:, 0],
+                "miny": bounds[:, 1],
+                "maxx": bounds[:, 2],
+                "maxy": bounds[:, 3],
+            }
+        )
+        .groupby(["TypeZone", "Zone"])
+        .agg(
+            {
+                "lat": "mean",
+                "lon": "mean",
+                "minx": "min",
+                "miny": "min",
+                "maxx": "max",
+                "maxy": "max",
+            }
+        )
+    )
+    return df.assign(zoom=[get_zoom(*key) for key in df.index])
+
+
+@store.dataset
+def load_zone_geometries():
+    regions = load_contour_regions()
+    regions_metropole = regions.loc[regions["REG"] > "10"]
+    departements = load_contour_departements()
+    epcis = load_contour_EPCIs()
+    return pd.concat(
+        [
+            _zone_geometries(
+                regions_metropole,
+                "Régions",
+                np.full(len(regions_metropole), region_default, dtype=object),
+            ),
+            _zone_geometries(regions, "Régions", regions["NOM_REG"]),
+            _zone_geometries(departements, "Départements", departements["NOM_DEP"]),
+            _zone_geometries(epcis, "Epci", epcis["Zone"]),
+        ]
+    )
+
+
+def get_zone_geometry(type_zone, zone):
+    """
+    Centre, limites et zoom suggéré pour la zone, précalculés au chargement des contours. Pour un EPCI sans
+    contour, les limites sont celles de son département
+
+    Args:
+        type_zone: str ('Epci', 'Départements', 'Régions')
+        zone: str
+
+    Returns: Series avec lat, lon, minx, miny, maxx, maxy, zoom
+    """
+    geometries = load_zone_geometries()
+    if (type_zone, zone) in geometries.index:
+        return geometries.loc[(type_zone, zone)]
+    if type_zone == "Epci":  # EPCI sans contour (voir enr_app.spatial)
+        zones = load_zones()
+        dep = zones.loc[
+            (zones["TypeZone"] == type_zone) & (zones["Zone"] == zone),
+            "Departement",
+        ].values[0]
+        return geometries.loc[("Départements", dep)]
+    raise KeyError((type_zone, zone))
+
+
+def get_map_bounds(map_state, type_zone, zone):
+    """
+    Limites visibles de la carte, telles que retournées par st_folium, ou limites de la zone avant la première
+    interaction
+
+    Args:
+        map_state: dict retourné par st_folium (ou None)
+        type_zone: str ('Epci', 'Départements', 'Régions')
+        zone: str
+
+    Returns: tuple (minx, miny, maxx, maxy) en degrés
+    """
+    try:
+        south_west = map_state["bounds"]["_southWest"]
+        north_east = map_state["bounds"]["_northEast"]
+        bounds = (
+            south_west["lng"],
+            south_west["lat"],
+            north_east["lng"],
+            north_east["lat"],
+        )
+    except (KeyError, TypeError):
+        bounds = (None,)
+    if None in bounds:  # pas encore d'interaction avec la carte
+        geometry = get_zone_geometry(type_zone, zone)
+        bounds = geometry["minx"], geometry["miny"], geometry["maxx"], geometry["maxy"]
+    return bounds
+
+
+# Contours sérialisés en GeoJSON, par génération des données et zone
+contour_cache = RenderCache(256, "contours")
+
+
+def get_contour_geojson(type_zone, zone):
+    """
+    Contour de la zone sérialisé en GeoJSON, gardé en cache par zone
+
+    Returns: str
+    """
+    return contour_cache.get(
+        (type_zone, zone),
+        lambda: get_contour(type_zone, zone).to_json(drop_id=True),
+    )
+
+
+@timed
+def get_map(type_zone, zone):
+    geometry = get_zone_geometry(type_zone, zone)
 
     ign = "https://wxs.ign.fr/essentiels/geoportail/wmts?REQUEST=GetTile&SERVICE=WMTS&VERSION=1.0.0&STYLE=normal&TILEMATRIXSET=PM&FORMAT=image/png&LAYER=GEOGRAPHICALGRIDSYSTEMS.PLANIGNV2&TILEMATRIX={z}&TILEROW={y}&TILECOL={x}"  # noqa
     mapa = folium.Map(
@@ -76,9 +283,213 @@ def get_map(type_zone, zone):
         attr='<a target="_blank" href="https://www.geoportail.gouv.fr/">Geoportail France</a>',
         min_zoom=2,
         max_zoom=18,
-        location=location,
+        location=[geometry["lat"], geometry["lon"]],
         zoom_start=get_zoom(type_zone, zone),
     )
-    gjson = folium.GeoJson(contour, name=type_zone)
+    mapa.fit_bounds(
+        [[geometry["miny"], geometry["minx"]], [geometry["maxy"], geometry["maxx"]]]
+    )
+    gjson = folium.GeoJson(get_contour_geojson(type_zone, zone), name=type_zone)
     gjson.add_to(mapa)
     return mapa
+
+
+def aggregate_installations(installations, cell_size):
+    """
+    Regroupe les installations par filière sur une grille régulière, en une passe vectorisée
+
+    Args:
+        installations: DataFrame avec les coordonnées x, y en EPSG:4326
+        cell_size: float, taille des cellules en degrés
+
+    Returns: DataFrame avec Filière, lon, lat (coin sud-ouest de la cellule), n (nombre) et puiss_MW.
+        Les installations sans coordonnées ou sans filière sont ignorées
+    """
+    codes, liste_filieres = pd.factorize(installations["Filière"])
+    x = installations["x"].to_numpy(dtype=float)
+    y = installations["y"].to_numpy(dtype=float)
+    # floor(NaN).astype(int64) donnerait une cellule arbitraire, et le code -1 une filière arbitraire
+    valid = np.isfinite(x) & np.isfinite(y) & (codes >= 0)
+    cells = np.stack(
+        [
+            codes[valid],
+            np.floor(x[valid] / cell_size).astype(np.int64),
+            np.floor(y[valid] / cell_size).astype(np.int64),
+        ],
+        axis=1,
+    )
+    cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    puissance = np.nan_to_num(installations["puiss_MW"].to_numpy(dtype=float)[valid])
+    return pd.DataFrame(
+        {
+            "Filière": np.asarray(liste_filieres)[cells[:, 0]],
+            "lon": cells[:, 1] * cell_size,
+            "lat": cells[:, 2] * cell_size,
+            "n": np.bincount(inverse, minlength=len(cells)),
+            "puiss_MW": np.bincount(inverse, weights=puissance, minlength=len(cells)),
+        }
+    )
+
+
+def add_grid_layers(mapa, installations, zoom, shading="n"):
+    """
+    Ajoute une couche par filière avec les installations regroupées en cellules, dont l'opacité augmente avec
+    le nombre d'installations ou leur puissance (les deux sont affichés au survol)
+
+    Args:
+        mapa: folium.Map
+        installations: DataFrame avec les coordonnées x, y
+        zoom: int, zoom de la carte, pour la taille des cellules
+        shading: str, "n" (nombre) ou "puiss_MW" (puissance), voir grid_shadings (default: "n")
+
+    Returns: None
+    """
+    cell_size = grid_sizes[zoom]
+    cells = aggregate_installations(installations, cell_size)
+    fill_colors = filiere_styles(colors, cells["Filière"].unique())
+    intensity = np.log1p(cells[shading].to_numpy(dtype=float))
+    cells = cells.assign(intensity=intensity / max(intensity.max(), 1e-9))
+    for name, group in cells.groupby("Filière"):
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [
+                            [lon, lat],
+                            [lon + cell_size, lat],
+                            [lon + cell_size, lat + cell_size],
+                            [lon, lat + cell_size],
+                            [lon, lat],
+                        ]
+                    ],
+                },
+                "properties": {
+                    "Filière": name,
+                    "Installations": int(n),
+                    "Puissance (MW)": round(puiss, 1),
+                    "opacity": round(0.15 + 0.6 * intensity, 2),
+                },
+            }
+            for lon, lat, n, puiss, intensity in zip(
+                group["lon"],
+                group["lat"],
+                group["n"],
+                group["puiss_MW"],
+                group["intensity"],
+            )
+        ]
+        color = fill_colors[name]
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            name=name,
+            style_function=lambda feature, color=color: {
+                "color": color,
+                "weight": 0,
+                "fillColor": color,
+                "fillOpacity": feature["properties"]["opacity"],
+            },
+            tooltip=folium.GeoJsonTooltip(
+                ["Filière", "Installations", "Puissance (MW)"]
+            ),
+        ).add_to(mapa)
+
+
+@timed
+def add_marker_layers(mapa, installations, columns):
+    """
+    Ajoute une couche par filière avec un marqueur par installation
+
+    Args:
+        mapa: folium.Map
+        installations: DataFrame avec les coordonnées x, y
+        columns: list, colonnes affichées dans le popup
+
+    Returns: None
+    """
+    icons = filiere_styles(icon_colors, installations["Filière"].dropna().unique())
+    for name, group in installations.groupby("Filière", observed=True):
+        tooltip = folium.GeoJsonTooltip(["nominstallation", "Filière"])
+        popup = folium.GeoJsonPopup(columns)
+        marker = folium.Marker(icon=folium.Icon(color=icons[name]))
+        gjson = folium.GeoJson(
+            installations_geometry(group[columns + ["x", "y"]]).to_json(
+                drop_id=True, default=str
+            ),
+            name=name,
+            tooltip=tooltip,
+            popup=popup,
+            marker=marker,
+        )
+        gjson.add_to(mapa)
+
+
+@timed
+def add_installations(mapa, installations, type_zone, zone, columns, shading="n"):
+    """
+    Ajoute les installations à la carte : regroupées en cellules pour la France entière, les régions et les
+    sélections de plus de max_markers installations, un marqueur par installation sinon
+
+    Args:
+        mapa: folium.Map
+        installations: DataFrame avec les coordonnées x, y
+        type_zone: str ('Epci', 'Départements', 'Régions')
+        zone: str
+        columns: list, colonnes affichées dans le popup des marqueurs
+        shading: str, intensité des cellules (voir add_grid_layers)
+
+    Returns: bool, True si les installations sont regroupées
+    """
+    zoom = get_zoom(type_zone, zone)
+    if type_zone == "Régions" or len(installations) > max_markers:
+        add_grid_layers(mapa, installations, zoom, shading)
+        return True
+    add_marker_layers(mapa, installations, columns)
+    return False
+
+
+# Cartes déjà produites, par sélection (voir get_map_html)
+map_cache = RenderCache(int(os.environ.get("ENR_MAP_CACHE_SIZE", 32)), "cartes")
+
+
+@timed
+def render_map(mapa):
+    """
+    HTML de la carte, comme l'affiche streamlit_folium.folium_static
+
+    Returns: str
+    """
+    return folium.Figure().add_child(mapa).render()
+
+
+@timed
+def get_map_html(type_zone, zone, filiere, show_installations, columns, shading="n"):
+    """
+    Carte de la zone avec ses installations, rendue en HTML et gardée en cache par sélection
+
+    Args:
+        type_zone: str ('Epci', 'Départements', 'Régions')
+        zone: str
+        filiere: list, filières sélectionnées
+        show_installations: bool
+        columns: list, colonnes affichées dans le popup des marqueurs
+        shading: str, intensité des cellules si les installations sont regroupées (voir add_grid_layers)
+
+    Returns: tuple (html, bool: True si les installations sont regroupées)
+    """
+
+    def render():
+        mapa = get_map(type_zone, zone)
+        grouped = False
+        if show_installations:
+            installations = select_installations(type_zone, zone, filiere)
+            grouped = len(installations) > 0 and add_installations(
+                mapa, installations.reset_index(), type_zone, zone, columns, shading
+            )
+        folium.LayerControl().add_to(mapa)
+        return render_map(mapa), grouped
+
+    key = (type_zone, zone, tuple(filiere), show_installations, tuple(columns), shading)
+    return map_cache.get(key, render)
@@ -2,6 +2,7 @@ import altair as alt
 import pandas as pd
 import streamlit as st
 
+from enr_app.exports import export_buttons
 from enr_app.general import (
     get_colors,
     get_markers,
@@ -12,8 +13,12 @@ from enr_app.general import (
     select_indicateur,
     select_zone,
 )
+from enr_app.store import store
+from enr_app.timing import lap, start_rerun, timing_panel
 
 remove_page_items()
+start_rerun("Production")
+store.pin()  # mêmes versions des données pendant toute l'exécution
 type_zone, zone = select_zone()
 filieres = select_filieres()
 
@@ -98,14 +103,14 @@ if add_sraddet:
 
 c = alt.layer(*layers).resolve_scale(color="independent", shape="independent")
 st.altair_chart(c)
+lap("graphique")
 st.caption(f'Source: {get_sources("energie_GWh", type_zone)}')
 
 
-st.download_button(
-    "Exporter au format csv",
-    data=df.to_csv(index=False),
-    file_name="production.csv",
-    mime="text/csv",
+export_buttons(
+    df, "production", ("production", type_zone, zone, tuple(filieres), add_sraddet)
 )
 st.dataframe(df)
 st.caption(f"Source: {get_sources(indicateur, type_zone)}")
+lap("tableau")
+timing_panel()
@@ -1,6 +1,7 @@
 import altair as alt
 import streamlit as st
 
+from enr_app.exports import export_buttons
 from enr_app.general import (
     get_colors,
     get_sources,
@@ -9,8 +10,12 @@ from enr_app.general import (
     select_indicateur,
     select_zone,
 )
+from enr_app.store import store
+from enr_app.timing import lap, start_rerun, timing_panel
 
 remove_page_items()
+start_rerun("Installations")
+store.pin()  # mêmes versions des données pendant toute l'exécution
 type_zone, zone = select_zone()
 filieres = select_filieres()
 
@@ -39,13 +44,11 @@ c = (
 )
 
 st.altair_chart(c)
+lap("graphique")
 st.caption(f"Source: {get_sources(indicateur, type_zone)}")
 
-st.download_button(
-    "Exporter au format csv",
-    data=df.to_csv(index=False),
-    file_name="nombre_installations.csv",
-    mime="text/csv",
-)
+export_buttons(df, "nombre_installations", ("nombre", type_zone, zone, tuple(filieres)))
 st.dataframe(df, width=600)
 st.caption(f"Source: {get_sources(indicateur, type_zone)}")
+lap("tableau")
+timing_panel()
@@ -1,63 +1,119 @@
 import altair as alt
 import streamlit as st
 
+from enr_app.comparison import get_annees, rank_zones
+from enr_app.exports import export_buttons
 from enr_app.general import (
     get_colors,
     get_sources,
-    load_zones,
+    indicateurs_pages,
+    load_zone_tree,
     remove_page_items,
     select_filieres,
     select_indicateur,
 )
+from enr_app.store import store
+from enr_app.table import paginated_table
+from enr_app.timing import lap, start_rerun, timing_panel
 
 remove_page_items()
+start_rerun("Comparaison")
+store.pin()  # mêmes versions des données pendant toute l'exécution
 st.title("Comparer les territoires")
 
-n_max = 10
-st.sidebar.write(f"Maximum {n_max} options")
+mode = st.sidebar.radio(
+    "Comparaison", ["Territoires choisis", "Classement"], key="mode_comparaison"
+)
+indicateur = st.sidebar.selectbox("Indicateur", indicateurs_pages, key="indicateur")
+annees = get_annees(indicateur)
+annee = st.sidebar.selectbox("Année", annees, index=len(annees) - 1, key="annee")
+filieres = select_filieres()
+
+
+def show_ranking():
+    """
+    Classement de tous les territoires d'un type : les premiers ou les derniers, et la place d'un territoire choisi
+    """
+    type_zone = st.sidebar.selectbox(
+        "Territoires", ["Régions", "Départements", "Epci"], key="type_classement"
+    )
+    classement = rank_zones(type_zone, indicateur, annee, filieres)
+    if not len(classement):
+        st.write("Pas de donnée pour l'année et les filières sélectionnées")
+        return
+    n = st.sidebar.slider("Nombre de territoires", 5, 50, 10, key="n_classement")
+    ordre = st.sidebar.radio(
+        "Afficher", ["Premiers", "Derniers"], horizontal=True, key="ordre_classement"
+    )
+    zone = st.sidebar.selectbox(
+        "Situer un territoire", classement["Zone"], index=None, key="zone_classement"
+    )
+
+    st.write(f"### {indicateur} en {annee} : {len(classement)} territoires")
+    if zone is not None:
+        row = classement.loc[classement["Zone"] == zone].iloc[0]
+        col_rang, col_percentile, col_evolution = st.columns(3)
+        col_rang.metric("Rang", f"{row['rang']} / {len(classement)}")
+        col_percentile.metric("Percentile", f"{row['percentile']:.0f}")
+        col_evolution.metric(
+            "Évolution sur un an",
+            "-" if row.isna()["évolution (%)"] else f"{row['évolution (%)']:+.1f} %",
+        )
+    top = classement.head(n) if ordre == "Premiers" else classement.tail(n)
+    if zone is not None and zone not in top["Zone"].to_list():
+        top = classement.loc[
+            classement["Zone"].isin(top["Zone"]) | (classement["Zone"] == zone)
+        ]
+    c = (
+        alt.Chart(top, width=700, height=25 * len(top))
+        .mark_bar()
+        .encode(
+            x=alt.X("valeur:Q", title=indicateur),
+            y=alt.Y("Zone:N", sort=None),
+            color=alt.condition(
+                alt.datum.Zone == (zone or ""),
+                alt.value("#d62728"),
+                alt.value("#1f77b4"),
+            ),
+            tooltip=["Zone", "valeur", "rang", "percentile", "évolution (%)"],
+        )
+    )
+    st.altair_chart(c)
+    lap("graphique")
+    st.caption(f"Source: {get_sources(indicateur, type_zone)}")
 
+    key = ("classement", type_zone, indicateur, annee, tuple(filieres))
+    export_buttons(classement, "classement", key)
+    paginated_table(classement, key, ["Zone"])
+    lap("tableau")
 
-def limit_choices(key):
-    if len(st.session_state[key]) > n_max:
-        st.session_state[key] = st.session_state[key][:n_max]
 
+if mode == "Classement":
+    show_ranking()
+    timing_panel()
+    st.stop()
 
-liste_regions = load_zones().set_index("TypeZone").loc["Régions", "Zone"].to_list()
+zone_tree = load_zone_tree()
 regions = st.sidebar.multiselect(
-    "Régions", liste_regions, key="regions", on_change=limit_choices, args=("regions",)
+    "Régions",
+    zone_tree.regions,
+    key="regions",
 )
 
-reg = regions or slice(None)
 liste_departements = (
-    load_zones()
-    .set_index(["TypeZone", "Region"])
-    .loc[("Départements", reg), "Zone"]
-    .to_list()
+    sorted(dep for reg in regions for dep in zone_tree.departements(reg))
+    if regions
+    else zone_tree.departements()
 )
 departements = st.sidebar.multiselect(
     "Départements",
     liste_departements,
     key="departements",
-    on_change=limit_choices,
-    args=("departements",),
 )
 
 type_zone = "Départements" if departements else "Régions"
 zone = departements or regions
 
-indicateurs = select_indicateur(type_zone, zone).reset_index()
-
-cols = indicateurs.columns.drop(
-    ["TypeZone", "Zone", "annee", "Filière", "type_estimation"]
-)
-indicateur = st.sidebar.selectbox("Indicateur", cols)
-
-annees = sorted(indicateurs["annee"].unique())
-annee = st.sidebar.selectbox("Année", annees)
-
-filieres = select_filieres()
-
-
 if zone:
     try:
         df = select_indicateur(
@@ -75,15 +131,19 @@ if zone:
             )
         )
         st.altair_chart(c)
+        lap("graphique")
         st.caption(f"Source: {get_sources(indicateur, type_zone)}")
 
-        st.download_button(
-            "Exporter au format csv",
-            data=df.to_csv(index=False),
-            file_name="nombre_installations.csv",
-            mime="text/csv",
+        export_buttons(
+            df,
+            "comparaison",
+            ("comparaison", type_zone, tuple(zone), tuple(filieres), annee, indicateur),
         )
         st.dataframe(df)
+        classement = rank_zones(type_zone, indicateur, annee, filieres)
+        st.write(f"Rang parmi les {len(classement)} {type_zone.lower()} :")
+        st.dataframe(classement.loc[classement["Zone"].isin(zone)], hide_index=True)
+        lap("tableau")
         st.caption(f"Source: {get_sources(indicateur, type_zone)}")
     except KeyError:
         st.write("Pas de donnée pour la zone et année sélectionnées")
@@ -91,3 +151,4 @@ else:
     st.write(
         "Veuillez sélectionner des régions ou départements, ainsi que l'année, l'indicateur et les filières"
     )
+timing_panel()
@@ -0,0 +1,87 @@
+__doc__ = """Rechargement à chaud des données : les versions des fichiers lus (ETag sur S3, date de modification
+en local) sont vérifiées en arrière-plan toutes les $ENR_RELOAD_INTERVAL secondes. Quand un fichier change, les jeux de
+données qui en dépendent sont rechargés hors des exécutions de page puis remplacés d'un coup (voir DataStore.reload)"""
+
+import logging
+import os
+import threading
+import time
+
+from enr_app.general import file_version
+from enr_app.store import store
+
+reload_interval = float(os.environ.get("ENR_RELOAD_INTERVAL", 0))
+logger = logging.getLogger("enr_app.reload")
+
+_started = threading.Lock()
+
+
+def changed_files():
+    """
+    Returns: dict {fichier: version actuelle} des fichiers lus dont la version a changé depuis leur lecture
+    """
+    files = store.files()
+    versions = {filename: file_version(filename) for filename in files}
+    return {
+        filename: version
+        for filename, version in versions.items()
+        if version not in (files[filename], None)
+    }
+
+
+def check_for_updates():
+    """
+    Recharge les jeux de données qui dépendent des fichiers modifiés
+
+    Returns: set des jeux de données rechargés
+    """
+    files = changed_files()
+    if not files:
+        return set()
+    for filename, version in files.items():
+        # Fichier lu hors des chargements (lecteur gpkg) : pas de jeu de données à recharger, la nouvelle version
+        # est enregistrée pour ne signaler le changement qu'une fois
+        if not store.dependents(files=[filename]):
+            store.add_file(filename, version)
+    names = store.dependents(files=files)
+    if not names:
+        generation = store.refresh()
+        logger.warning(
+            "Fichiers modifiés %s : caches vidés (génération %d)",
+            list(files),
+            generation,
+        )
+        return names
+    start = time.perf_counter()
+    generation = store.reload(names)
+    logger.warning(
+        "Fichiers modifiés %s : %s rechargés en %.1f s (génération %d)",
+        list(files),
+        sorted(names),
+        time.perf_counter() - start,
+        generation,
+    )
+    return names
+
+
+def start_reloader(interval=None):
+    """
+    Lance la vérification périodique, une seule fois par processus, si interval (default: $ENR_RELOAD_INTERVAL)
+    est positif
+
+    Returns: bool, True si la vérification a été lancée par cet appel
+    """
+    interval = reload_interval if interval is None else interval
+    if interval <= 0 or not _started.acquire(blocking=False):
+        return False
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                check_for_updates()
+            except Exception:  # les données actuelles restent en place
+                logger.exception("Échec du rechargement des données")
+
+    threading.Thread(target=run, name="reload", daemon=True).start()
+    return True
@@ -0,0 +1,20 @@
+__doc__ = """Lance l'application Streamlit après avoir démarré le chargement des données dans le même processus
+
+Usage: python -m enr_app.serve [enr_app/01_🏠_Accueil.py] [options de streamlit run]"""
+
+import sys
+from pathlib import Path
+
+from streamlit.web import cli as stcli
+
+from enr_app.warmup import start_warm_up
+
+main_script = str(Path(__file__).parent / "01_🏠_Accueil.py")
+
+if __name__ == "__main__":
+    start_warm_up()
+    args = sys.argv[1:]
+    if not args or args[0].startswith("-"):
+        args = [main_script] + args
+    sys.argv = ["streamlit", "run"] + args
+    sys.exit(stcli.main())
@@ -0,0 +1,166 @@
+__doc__ = """Partage des jeux de données entre les processus d'un même nœud, dans des fichiers Arrow IPC en mémoire
+partagée (par exemple /dev/shm/enr_app, voir $ENR_SHARED_DIR)
+
+Le premier processus qui charge un DataFrame le publie, les suivants l'ouvrent en mémoire projetée (mmap) :
+les colonnes numériques ne sont pas copiées, la mémoire utilisée reste la même quel que soit le nombre de
+processus. Les chaînes de caractères ne sont pas copiées non plus avec pandas >= 3, où elles restent stockées par
+Arrow ; avec pandas 2, elles sont converties en objets Python (dtype object) dans chaque processus. Les
+géométries (contours) sont stockées en WKB et reconstruites par chaque processus. Chaque fichier garde les
+versions des fichiers de données à partir desquels il a été produit : il est reconstruit quand l'un d'eux change"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+_geo_metadata = b"enr_app.geometry"
+_sources_metadata = b"enr_app.sources"
+
+
+class SharedDatasets:
+    """
+    Fichiers Arrow IPC non compressés, un par jeu de données, écrits une seule fois par nœud
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory: str ou Path, répertoire en mémoire partagée (créé si besoin)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name):
+        return self.directory / f"{name}.arrow"
+
+    @contextmanager
+    def _lock(self, name):
+        # Verrou entre processus : un seul chargement par nœud
+        with open(self.directory / f"{name}.lock", "w") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def load(self, name, loader, sources):
+        """
+        Ouvre le jeu de données publié par un autre processus, ou le charge et le publie s'il n'existe pas encore
+        ou si un des fichiers de données dont il est issu a changé depuis. Les objets qui ne sont pas des
+        DataFrame, ou que Arrow ne peut pas représenter (colonnes de types mélangés), sont chargés par chaque
+        processus
+
+        Args:
+            name: str, nom du jeu de données
+            loader: fonction sans arguments qui retourne le jeu de données
+            sources: fonction sans arguments, appelée après loader, qui retourne dict {fichier: version} des
+                fichiers de données lus
+
+        Returns: DataFrame (projeté en mémoire) ou objet retourné par loader, dict {fichier: version} des
+            fichiers de données dont il est issu
+        """
+        with self._lock(name):
+            files = self.sources(name)
+            if files is None or _changed(files):
+                data = loader()
+                files = sources()
+                if not isinstance(data, pd.DataFrame):
+                    return data, files
+                try:
+                    self.publish(name, data, files)
+                except pa.ArrowException:
+                    return data, files
+        return self.attach(name), files
+
+    def sources(self, name):
+        """
+        Returns: dict {fichier: version} des fichiers de données dont est issu le jeu de données publié, None s'il
+            n'est pas publié
+        """
+        try:
+            with pa.memory_map(str(self.path(name))) as source:
+                metadata = pa.ipc.open_file(source).schema.metadata or {}
+        except FileNotFoundError:
+            return None
+        return json.loads(metadata.get(_sources_metadata, b"{}"))
+
+    def publish(self, name, data, sources=None):
+        """
+        Écrit le DataFrame (GeoDataFrame: géométrie en WKB) dans un fichier Arrow IPC (remplacement atomique)
+
+        Args:
+            name: str, nom du jeu de données
+            data: DataFrame ou GeoDataFrame
+            sources: dict {fichier: version} des fichiers de données dont il est issu (default: aucun)
+
+        Returns: None
+        """
+        metadata = {_sources_metadata: json.dumps(sources or {})}
+        if hasattr(data, "geometry"):
+            column = data.geometry.name
+            metadata[_geo_metadata] = json.dumps(
+                {"column": column, "crs": data.crs.to_string() if data.crs else None}
+            )
+            data = pd.DataFrame(data).assign(
+                **{column: data.geometry.to_wkb().to_numpy()}
+            )
+        table = pa.Table.from_pandas(data, preserve_index=True)
+        table = table.replace_schema_metadata({**table.schema.metadata, **metadata})
+        path = self.path(name)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with pa.OSFile(str(tmp), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+    def attach(self, name):
+        """
+        Ouvre un jeu de données publié, sans copie des colonnes numériques (ni des chaînes de caractères avec
+        pandas >= 3)
+
+        Args:
+            name: str, nom du jeu de données
+
+        Returns: DataFrame ou GeoDataFrame
+        """
+        with pa.memory_map(str(self.path(name))) as source:
+            table = pa.ipc.open_file(source).read_all()
+        data = table.to_pandas(split_blocks=True)
+        geo = (table.schema.metadata or {}).get(_geo_metadata)
+        if geo is not None:
+            import geopandas as gpd
+
+            geo = json.loads(geo)
+            data = gpd.GeoDataFrame(
+                data.drop(columns=geo["column"]),
+                geometry=gpd.GeoSeries.from_wkb(
+                    data[geo["column"]].to_numpy(), index=data.index
+                ).rename(geo["column"]),
+                crs=geo["crs"],
+            )[list(data.columns)]
+        return data
+
+    def remove(self, name=None):
+        """
+        Supprime un jeu de données publié (ou tous), qui sera republié au prochain chargement. Les processus qui
+        l'ont déjà ouvert gardent leur projection en mémoire
+
+        Args:
+            name: str ou None (default: tous)
+
+        Returns: None
+        """
+        paths = [self.path(name)] if name else self.directory.glob("*.arrow")
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+
+def _changed(files):
+    # Un des fichiers de données a une autre version que celle enregistrée
+    from enr_app.general import file_version
+
+    return any(file_version(filename) != version for filename, version in files.items())
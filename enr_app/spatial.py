@@ -0,0 +1,248 @@
+__doc__ = """Attribution des installations à leur région, département et EPCI d'après leur géométrie, et contrôle des
+contours d'EPCI
+
+Chaque couche de contours est mise dans un STRtree, interrogé en une seule fois pour tous les points (shapely 2) :
+l'attribution ne dépend pas d'une boucle sur les installations et peut être refaite à chaque mise à jour des
+données (voir enr_app.build). Les installations hors de tout contour (éolien en mer...) gardent leurs zones.
+
+Usage: python -m enr_app.spatial [--output rapport.csv]"""
+
+import argparse
+import difflib
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Colonne des installations : (couche de contours, colonne avec le nom de la zone)
+zone_layers = {
+    "NOM_REG": ("regions", "NOM_REG"),
+    "NOM_DEP": ("departements", "NOM_DEP"),
+    "NOM_EPCI": ("EPCIs", "Zone"),
+}
+
+
+def locate(points, contour, column):
+    """
+    Zone qui contient chaque point. Un point sur une frontière commune est attribué à la première zone du contour
+
+    Args:
+        points: array de shapely.Point
+        contour: GeoDataFrame, dans le même système de coordonnées que les points
+        column: str, colonne du contour avec le nom de la zone
+
+    Returns: array (object) avec le nom de la zone, None pour les points hors de tout contour
+    """
+    tree = shapely.STRtree(np.asarray(contour.geometry.values))
+    point_index, contour_index = tree.query(points, predicate="intersects")
+    # Résultats triés par point : première zone trouvée pour chaque point
+    order = np.lexsort((contour_index, point_index))
+    point_index, contour_index = point_index[order], contour_index[order]
+    first = np.flatnonzero(np.r_[True, point_index[1:] != point_index[:-1]])
+    zones = np.full(len(points), None, dtype=object)
+    zones[point_index[first]] = contour[column].to_numpy(dtype=object)[
+        contour_index[first]
+    ]
+    return zones
+
+
+def locate_installations(installations, contours):
+    """
+    Args:
+        installations: GeoDataFrame
+        contours: dict {couche: GeoDataFrame} avec les couches de zone_layers, dans le système de coordonnées des
+            installations
+
+    Returns: DataFrame avec les colonnes NOM_REG, NOM_DEP et NOM_EPCI d'après la géométrie (None hors contours)
+    """
+    points = np.asarray(installations.geometry.values)
+    return pd.DataFrame(
+        {
+            col: locate(points, contours[layer], name)
+            for col, (layer, name) in zone_layers.items()
+        },
+        index=installations.index,
+    )
+
+
+def zone_mismatches(installations, located):
+    """
+    Installations dont la zone enregistrée n'est pas celle qui contient leur géométrie
+
+    Args:
+        installations: DataFrame avec NOM_REG, NOM_DEP, NOM_EPCI
+        located: DataFrame retourné par locate_installations
+
+    Returns: DataFrame avec une ligne par installation et par colonne en désaccord : position (iloc), colonne,
+        enregistrée, géométrie
+    """
+    frames = []
+    for col in zone_layers:
+        stored = installations[col].astype(object).to_numpy()
+        found = located[col].to_numpy()
+        positions = np.flatnonzero(pd.notna(found) & (stored != found))
+        frames.append(
+            pd.DataFrame(
+                {
+                    "position": positions,
+                    "colonne": col,
+                    "enregistrée": stored[positions],
+                    "géométrie": found[positions],
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def count_mismatches(mismatches):
+    """
+    Returns: dict {colonne: nombre d'installations en désaccord} (voir zone_mismatches)
+    """
+    counts = mismatches["colonne"].value_counts()
+    return {col: int(counts.get(col, 0)) for col in zone_layers}
+
+
+def missing_epcis(zones, epcis, installations):
+    """
+    EPCIs du référentiel (epcis.csv) absents de la couche des contours. Le contour candidat est le contour hors
+    référentiel (EPCI renommé ou fusionné) qui contient le plus d'installations enregistrées dans l'EPCI, ou à défaut
+    le nom de contour hors référentiel le plus proche : ce candidat par le nom seul (installations = 0) est
+    seulement signalé, jamais appliqué (voir fill_missing_epcis). Un contour n'est candidat que pour un EPCI
+
+    Args:
+        zones: DataFrame des zones (voir enr_app.general.load_zones)
+        epcis: GeoDataFrame, couche des contours d'EPCI (colonne Zone)
+        installations: GeoDataFrame avec NOM_EPCI
+
+    Returns: DataFrame avec Zone, Departement, candidat (None si aucun) et installations (nombre dans le candidat)
+    """
+    referentiel = zones.loc[zones["TypeZone"] == "Epci", ["Zone", "Departement"]]
+    missing = referentiel.loc[~referentiel["Zone"].isin(epcis["Zone"])].reset_index(
+        drop=True
+    )
+    unknown = epcis.loc[~epcis["Zone"].isin(referentiel["Zone"])]
+    candidates = pd.DataFrame(columns=["Zone", "candidat", "installations"])
+    if len(missing) and len(unknown):
+        concerned = installations.loc[installations["NOM_EPCI"].isin(missing["Zone"])]
+        located = locate(np.asarray(concerned.geometry.values), unknown, "Zone")
+        votes = (
+            pd.DataFrame(
+                {
+                    "Zone": concerned["NOM_EPCI"].astype(object).to_numpy(),
+                    "candidat": located,
+                }
+            )
+            .dropna()
+            .value_counts()
+            .rename("installations")
+            .reset_index()
+            .drop_duplicates("Zone")  # le contour qui contient le plus d'installations
+        )
+        candidates = votes.drop_duplicates("candidat")
+    missing = missing.merge(candidates, on="Zone", how="left").astype(
+        {"candidat": object}
+    )
+    names = [x for x in unknown["Zone"] if x not in set(missing["candidat"].dropna())]
+    for i in np.flatnonzero(missing["candidat"].isna().to_numpy()):
+        close = difflib.get_close_matches(missing.at[i, "Zone"], names, n=1, cutoff=0.8)
+        if close:
+            missing.at[i, "candidat"] = close[0]
+            names.remove(close[0])
+    missing["installations"] = missing["installations"].fillna(0).astype(int)
+    return missing
+
+
+def fill_missing_epcis(epcis, missing):
+    """
+    Renomme les contours candidats qui contiennent des installations de l'EPCI du référentiel avec le nom de cet
+    EPCI (voir missing_epcis). Les candidats trouvés par le nom seul ne sont pas appliqués
+
+    Returns: GeoDataFrame des contours d'EPCI
+    """
+    filled = filled_epcis(missing)
+    names = dict(zip(filled["candidat"], filled["Zone"]))
+    return epcis.assign(Zone=epcis["Zone"].replace(names))
+
+
+def filled_epcis(missing):
+    """
+    Returns: lignes de missing (voir missing_epcis) dont le candidat contient des installations de l'EPCI
+    """
+    return missing.loc[missing["candidat"].notna() & (missing["installations"] > 0)]
+
+
+def assign_zones(installations, contours, zones):
+    """
+    Complète la couche des contours d'EPCI puis attribue à chaque installation les zones qui contiennent sa
+    géométrie (les zones enregistrées sont gardées hors des contours)
+
+    Args:
+        installations: GeoDataFrame
+        contours: dict {couche: GeoDataFrame} avec regions, departements et EPCIs
+        zones: DataFrame des zones (voir enr_app.general.load_zones)
+
+    Returns: installations corrigées, contours d'EPCI complétés, dict avec les corrections par colonne, le nombre
+        d'installations hors contours, les EPCIs complétés, ceux qui restent sans contour et, parmi eux, ceux dont
+        un contour a un nom proche (à vérifier)
+    """
+    missing = missing_epcis(zones, contours["EPCIs"], installations)
+    contours = {**contours, "EPCIs": fill_missing_epcis(contours["EPCIs"], missing)}
+    located = locate_installations(installations, contours)
+    mismatches = zone_mismatches(installations, located)
+    corrected = installations.assign(
+        **{
+            col: located[col].fillna(installations[col].astype(object))
+            for col in zone_layers
+        }
+    )
+    report = {
+        "corrections": count_mismatches(mismatches),
+        "hors_contours": int(located["NOM_EPCI"].isna().sum()),
+        "epcis_completes": filled_epcis(missing)["Zone"].tolist(),
+        "epcis_sans_contour": missing.loc[
+            ~missing.index.isin(filled_epcis(missing).index), "Zone"
+        ].tolist(),
+        "epcis_noms_proches": dict(
+            missing.loc[
+                missing["candidat"].notna() & (missing["installations"] == 0),
+                ["Zone", "candidat"],
+            ].to_numpy()
+        ),
+    }
+    return corrected, contours["EPCIs"], report
+
+
+def main(argv=None):
+    from enr_app.artifact import prepare_layer
+    from enr_app.general import load_zones
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--output",
+        help="fichier csv des installations en désaccord avec leur géométrie",
+    )
+    args = parser.parse_args(argv)
+
+    installations = prepare_layer("installations")
+    contours = {layer: prepare_layer(layer) for layer, _ in zone_layers.values()}
+    missing = missing_epcis(load_zones(), contours["EPCIs"], installations)
+    contours["EPCIs"] = fill_missing_epcis(contours["EPCIs"], missing)
+    mismatches = zone_mismatches(
+        installations, locate_installations(installations, contours)
+    )
+    print(f"{len(installations)} installations, en désaccord avec leur géométrie :")
+    for col, count in count_mismatches(mismatches).items():
+        print(f"  {col}: {count}")
+    if len(missing):
+        print(
+            "EPCIs sans contour (candidat sans installations : nom proche, non appliqué) :"
+        )
+        print(missing.to_string(index=False))
+    if args.output:
+        mismatches.join(
+            installations[["nominstallation"]].reset_index(drop=True), on="position"
+        ).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
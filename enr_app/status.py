@@ -0,0 +1,33 @@
+__doc__ = """État du chargement des données au démarrage (écrit par enr_app.warmup), pour les sondes Docker / helm
+
+`python enr_app/status.py` retourne 0 quand tous les jeux de données sont chargés, 1 sinon. Ce module n'utilise que
+la bibliothèque standard : lancé par son chemin, il n'importe ni le paquet enr_app ni pandas ou streamlit, et la
+sonde reste rapide même quand le serveur est chargé"""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+status_path = Path(
+    os.environ.get(
+        "ENR_STATUS_FILE", Path(tempfile.gettempdir(), "enr_app", "status.json")
+    )
+)
+
+
+def read_status():
+    """
+    Returns: dict écrit par enr_app.warmup.write_status, {"ready": False} si le fichier est absent ou illisible
+    """
+    try:
+        return json.loads(status_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"ready": False}
+
+
+if __name__ == "__main__":
+    status = read_status()
+    print(json.dumps(status, indent=1))
+    sys.exit(0 if status.get("ready") else 1)
@@ -0,0 +1,450 @@
+__doc__ = """Stockage partagé (par processus) des jeux de données de l'application
+
+Chaque jeu de données est chargé une seule fois et toutes les sessions reçoivent des vues en lecture seule,
+sans hachage ni copie à chaque appel (contrairement à @st.cache). Avec $ENR_SHARED_DIR (par exemple
+/dev/shm/enr_app), les DataFrame sont aussi partagés entre les processus du nœud (voir enr_app.shared)
+
+Les fichiers lus et les jeux de données utilisés pendant chaque chargement sont enregistrés : quand un fichier
+change, `reload` recharge en arrière-plan les jeux de données qui en dépendent (et ceux qui en sont dérivés), puis
+les remplace tous d'un coup (voir enr_app.reload)"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+from enr_app.shared import SharedDatasets
+from enr_app.timing import span
+
+# Par thread : jeux de données en cours de chargement, version des données fixée (pin) et rechargement en cours
+_local = threading.local()
+
+
+class DataStore:
+    """
+    Registre des jeux de données de l'application, chargés à la demande une seule fois par processus
+
+    Les fonctions de chargement sont enregistrées avec le décorateur `dataset`, qui remplace la fonction par un
+    accès au registre. Le nombre de chargements et leur durée sont enregistrés pour chaque jeu de données.
+
+    Les données forment une génération (numéro, dictionnaire des jeux de données), remplacée en une seule
+    affectation lors d'un rechargement. Une exécution de page fixe sa génération avec `pin` et voit donc toujours
+    des jeux de données cohérents entre eux.
+    """
+
+    def __init__(self, shared=None):
+        """
+        Args:
+            shared: SharedDatasets, pour partager les DataFrame entre processus (default: None)
+        """
+        self.shared = shared
+        self._loaders = {}
+        self._state = (0, {})  # génération, {jeu de données: données}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        # jeu de données: {"files": fichiers lus, "datasets": jeux de données utilisés}
+        self._deps = {}
+        self._files = {}  # fichier: version lue
+        self._callbacks = []
+
+    def dataset(self, func):
+        """
+        Décorateur : enregistre la fonction de chargement sous son nom sans le préfixe "load_"
+
+        Args:
+            func: fonction sans arguments qui retourne le jeu de données
+
+        Returns: fonction qui retourne une vue du jeu de données partagé
+        """
+        name = func.__name__
+        if name.startswith("load_"):
+            name = name[len("load_") :]
+        self.register(name, func)
+
+        def get():
+            return self.get(name)
+
+        get.__name__ = func.__name__
+        get.__doc__ = func.__doc__
+        get.dataset = name
+        return get
+
+    def register(self, name, loader):
+        """
+        Enregistre une fonction de chargement
+
+        Args:
+            name: str, nom du jeu de données
+            loader: fonction sans arguments qui retourne le jeu de données
+
+        Returns: None
+        """
+        with self._lock:
+            self._add(name, loader)
+
+    def _add(self, name, loader):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+        self._stats[name] = {"loads": 0, "seconds": 0.0, "total_seconds": 0.0}
+
+    def get(self, name, loader=None):
+        """
+        Retourne une vue en lecture seule du jeu de données, qui est chargé au premier appel
+
+        Args:
+            name: str, nom du jeu de données
+            loader: fonction de chargement, enregistrée si le jeu de données ne l'est pas encore (default: None)
+
+        Returns: DataFrame, GeoDataFrame ou autre objet retourné par la fonction de chargement
+        """
+        self._depends("datasets", name)
+        staging = getattr(_local, "staging", None)
+        if staging is not None and name in staging["names"]:  # rechargement en cours
+            with self._locks[name]:
+                if name not in staging["data"]:
+                    staging["data"][name] = self._load(name)
+            return _view(staging["data"][name])
+        data = self._current()[1]
+        try:
+            return _view(data[name])
+        except KeyError:
+            pass
+        if data is not self._state[1]:
+            # Génération fixée remplacée depuis : charger le jeu de données maintenant mélangerait anciennes et
+            # nouvelles données dans la même exécution, qui est relancée sur la génération actuelle
+            self.pin()
+            st.rerun()
+            return self.get(name)  # hors d'une exécution de page
+        if loader is not None and name not in self._loaders:
+            with self._lock:
+                if name not in self._loaders:
+                    self._add(name, loader)
+        # Un seul chargement même si plusieurs sessions arrivent en même temps
+        with self._locks[name]:
+            if name not in data:
+                data[name] = self._load(name)
+        return _view(data[name])
+
+    def _current(self):
+        return getattr(_local, "state", None) or self._state
+
+    def _depends(self, kind, value):
+        # Enregistre une dépendance du jeu de données en cours de chargement dans ce thread
+        loading = getattr(_local, "loading", None)
+        if loading:
+            loading[-1][kind].add(value)
+
+    def _load(self, name):
+        # Appelé avec le verrou du jeu de données ; dépendances et statistiques remplacées d'un coup à la fin
+        start = time.perf_counter()
+        deps = {"files": set(), "datasets": set()}
+        loading = _local.__dict__.setdefault("loading", [])
+        loading.append(deps)
+        try:
+            with span(f"load_{name}"):
+                if self.shared is None:
+                    data = self._loaders[name]()
+                else:
+                    data, files = self.shared.load(
+                        name, self._loaders[name], lambda: self._sources(deps)
+                    )
+                    for (
+                        filename,
+                        version,
+                    ) in files.items():  # même si publié par un autre processus
+                        self.add_file(filename, version)
+        except Exception as e:
+            with self._lock:
+                self._stats[name] = {**self._stats[name], "error": repr(e)}
+            raise
+        finally:
+            loading.pop()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats[name]
+            self._stats[name] = {
+                "loads": stats["loads"] + 1,
+                "seconds": elapsed,
+                "total_seconds": stats["total_seconds"] + elapsed,
+            }
+            self._deps[name] = deps
+        return data
+
+    def _sources(self, deps):
+        # Fichiers lus par un chargement, directement ou à travers les jeux de données utilisés, avec leur version
+        files, names = set(deps["files"]), set(deps["datasets"])
+        while names:
+            name = names.pop()
+            used = self._deps.get(name, {"files": set(), "datasets": set()})
+            files |= used["files"]
+            names |= used["datasets"]
+        return {filename: self._files[filename] for filename in files}
+
+    def add_file(self, filename, version):
+        """
+        Enregistre la lecture d'un fichier (appelé par enr_app.general.local_path) par le jeu de données en cours
+        de chargement
+
+        Args:
+            filename: str, nom du fichier
+            version: str, version lue (ETag, date de modification...)
+
+        Returns: None
+        """
+        self._files[filename] = version
+        self._depends("files", filename)
+
+    def files(self):
+        """
+        Returns: dictionnaire {fichier: version lue}
+        """
+        return dict(self._files)
+
+    def dependents(self, files=(), names=()):
+        """
+        Jeux de données chargés qui lisent les fichiers ou utilisent les jeux de données, directement ou non
+
+        Args:
+            files: fichiers
+            names: jeux de données
+
+        Returns: set des jeux de données (y compris names)
+        """
+        result = set(names) | {
+            name
+            for name, deps in list(self._deps.items())
+            if deps["files"] & set(files)
+        }
+        while True:
+            more = {
+                name
+                for name, deps in list(self._deps.items())
+                if name not in result and deps["datasets"] & result
+            }
+            if not more:
+                return result & set(self._state[1])
+            result |= more
+
+    def reload(self, names):
+        """
+        Recharge les jeux de données (dans le thread appelant, hors des exécutions de page), puis les remplace
+        tous ensemble par une nouvelle génération. En cas d'erreur, les données actuelles sont gardées
+
+        Args:
+            names: set des jeux de données à recharger (voir dependents)
+
+        Returns: int, numéro de la nouvelle génération (la génération actuelle si names est vide)
+        """
+        if not names:
+            return self._state[0]
+        if self.shared is not None:
+            for name in names:
+                self.shared.remove(name)
+        _local.staging = {"names": set(names), "data": {}}
+        try:
+            for name in names:
+                self.get(name)
+            staged = _local.staging["data"]
+        finally:
+            del _local.staging
+        with self._lock:
+            generation, data = self._state
+            data = {k: v for k, v in data.items() if k not in staged}
+            self._state = (generation + 1, {**data, **staged})
+        self._invalidate()
+        return generation + 1
+
+    def refresh(self):
+        """
+        Nouvelle génération sans rechargement, pour vider les caches dérivés quand un fichier lu hors des chargements
+        change (lecteur gpkg des installations)
+
+        Returns: int, numéro de la nouvelle génération
+        """
+        with self._lock:
+            generation, data = self._state
+            self._state = (generation + 1, data)
+        self._invalidate()
+        return generation + 1
+
+    def on_reload(self, callback):
+        """
+        Enregistre une fonction sans arguments appelée après chaque rechargement (vidage des caches dérivés)
+
+        Returns: callback
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def _invalidate(self):
+        for cache in render_caches.values():
+            cache.clear()
+        for callback in self._callbacks:
+            callback()
+
+    def pin(self):
+        """
+        Fixe la génération des données vue par le thread courant (à appeler au début de chaque exécution de page).
+        Si la génération fixée est remplacée et qu'un jeu de données n'y est pas encore chargé, l'exécution est
+        relancée sur la nouvelle génération (voir get)
+
+        Returns: None
+        """
+        _local.state = self._state
+
+    def generation(self):
+        """
+        Returns: int, génération des données vue par le thread courant
+        """
+        return self._current()[0]
+
+    def is_loaded(self, name):
+        return name in self._state[1]
+
+    def status(self, name):
+        """
+        Returns: "ready" (chargé), "loading" (en cours), "error" (dernier chargement en erreur) ou "pending"
+        """
+        if name in self._state[1]:
+            return "ready"
+        if name in self._locks and self._locks[name].locked():
+            return "loading"
+        if "error" in self._stats.get(name, {}):
+            return "error"
+        return "pending"
+
+    def names(self):
+        """
+        Returns: liste des jeux de données enregistrés
+        """
+        return list(self._loaders)
+
+    def stats(self):
+        """
+        Returns: dictionnaire {jeu de données: {"status", "loads", "seconds", "total_seconds", ("error")}}
+        """
+        return {
+            name: {"status": self.status(name), **stats}
+            for name, stats in self._stats.items()
+        }
+
+    def clear(self, name=None):
+        """
+        Oublie un jeu de données (ou tous), qui sera rechargé au prochain accès (et republié s'il est partagé)
+
+        Args:
+            name: str ou None (default: tous)
+
+        Returns: None
+        """
+        with self._lock:
+            generation, data = self._state
+            data = {k: v for k, v in data.items() if name not in (None, k)}
+            self._state = (generation + 1, data)
+            if self.shared is not None:
+                self.shared.remove(name)
+        self._invalidate()
+
+
+# Caches de rendu enregistrés par nom, pour le suivi des taux de succès (voir enr_app.timing)
+render_caches = {}
+
+
+class RenderCache:
+    """
+    Cache LRU de taille bornée pour les résultats produits à partir des jeux de données (cartes, exports), avec
+    compteurs de succès (hits) et d'échecs (misses), partagé par les sessions
+    """
+
+    def __init__(self, maxsize, name=None, maxbytes=None):
+        """
+        Args:
+            maxsize: int, nombre maximum d'éléments
+            name: str, nom sous lequel le cache est enregistré dans render_caches (default: None, pas enregistré)
+            maxbytes: int, mémoire maximum des DataFrame gardés (default: None, pas de limite). Un DataFrame plus
+                grand n'est pas gardé
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        if name is not None:
+            render_caches[name] = self
+
+    def get(self, key, render):
+        """
+        Args:
+            key: clé hachable, complétée par la génération des données
+            render: fonction sans arguments qui produit la valeur en cas d'échec
+
+        Returns: valeur en cache, ou produite par render
+        """
+        key = (store.generation(), key)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        value = render()
+        size = _nbytes(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return value
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._sizes[key] = size
+            while len(self._items) > self.maxsize or (
+                self.maxbytes is not None and sum(self._sizes.values()) > self.maxbytes
+            ):
+                old, _ = self._items.popitem(last=False)
+                del self._sizes[old]
+        return value
+
+    def stats(self):
+        """
+        Returns: dict avec hits, misses, size et maxsize
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "bytes": sum(self._sizes.values()),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+
+
+def _nbytes(value):
+    # Mémoire d'un DataFrame (chaînes comprises), 0 pour les autres objets
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+
+def _view(data):
+    """
+    Vue sans copie des données : copie superficielle pour les objets pandas (en lecture seule grâce au
+    copy-on-write, activé dans enr_app/__init__.py), l'objet lui-même sinon
+    """
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.copy(deep=False)
+    return data
+
+
+store = DataStore(
+    shared=SharedDatasets(os.environ["ENR_SHARED_DIR"])
+    if os.environ.get("ENR_SHARED_DIR")
+    else None
+)
@@ -0,0 +1,114 @@
+__doc__ = """Tableau paginé : recherche et tri faits sur le serveur, seule la page affichée est envoyée au navigateur"""
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from enr_app.store import RenderCache
+from enr_app.timing import timed
+
+# Positions des lignes recherchées et triées, par sélection, recherche et tri
+table_cache = RenderCache(int(os.environ.get("ENR_TABLE_CACHE_SIZE", 16)), "tableaux")
+
+
+def search_mask(df, text, columns):
+    """
+    Lignes dont l'une des colonnes contient le texte (sans tenir compte de la casse). Pour les colonnes en
+    catégories, la recherche se fait sur les catégories puis sur les codes, sans parcourir les chaînes de chaque ligne
+
+    Args:
+        df: DataFrame
+        text: str
+        columns: list, colonnes où chercher
+
+    Returns: array de booléens
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            found = values.cat.categories.astype(str).str.contains(
+                text, case=False, regex=False
+            )
+            mask |= np.isin(values.cat.codes.to_numpy(), np.flatnonzero(found))
+        else:
+            mask |= (
+                values.astype(str)
+                .str.contains(text, case=False, regex=False, na=False)
+                .to_numpy()
+            )
+    return mask
+
+
+@timed
+def table_positions(df, key, search, search_columns, sort_by, ascending):
+    """
+    Positions des lignes retenues par la recherche, dans l'ordre du tri, gardées en cache
+
+    Args:
+        df: DataFrame
+        key: tuple, identifie la sélection (page, zone, filières...)
+        search: str, texte recherché ("" : toutes les lignes)
+        search_columns: list, colonnes où chercher
+        sort_by: str, colonne de tri (None : ordre de df)
+        ascending: bool
+
+    Returns: array de positions (iloc)
+    """
+
+    def compute():
+        positions = np.arange(len(df), dtype=np.int32)
+        if search:
+            positions = positions[search_mask(df, search, search_columns)]
+        if sort_by is not None:
+            values = df[sort_by].iloc[positions].reset_index(drop=True)
+            order = values.sort_values(
+                ascending=ascending, kind="stable", na_position="last"
+            ).index.to_numpy()
+            positions = positions[order]
+        return positions
+
+    return table_cache.get((key, search, sort_by, ascending), compute)
+
+
+def paginated_table(df, key, search_columns, page_sizes=(50, 100, 500)):
+    """
+    Affiche le tableau page par page, avec recherche et tri faits sur le serveur
+
+    Args:
+        df: DataFrame
+        key: tuple, identifie la sélection (page, zone, filières...), pour le cache et les widgets
+        search_columns: list, colonnes où chercher
+        page_sizes: tailles de page proposées
+
+    Returns: None
+    """
+    prefix = f"table_{key[0]}"
+    col_search, col_sort, col_order, col_size = st.columns([3, 2, 1, 1])
+    search = col_search.text_input("Rechercher", key=f"{prefix}_search").strip()
+    sort_by = col_sort.selectbox(
+        "Trier par", list(df.columns), index=None, key=f"{prefix}_sort"
+    )
+    ascending = (
+        col_order.selectbox(
+            "Ordre", ["Croissant", "Décroissant"], key=f"{prefix}_order"
+        )
+        == "Croissant"
+    )
+    page_size = col_size.selectbox("Lignes", page_sizes, key=f"{prefix}_size")
+
+    positions = table_positions(df, key, search, search_columns, sort_by, ascending)
+    n_pages = max(1, math.ceil(len(positions) / page_size))
+    # La page gardée dans la session peut dépasser le nombre de pages d'une nouvelle sélection
+    if st.session_state.get(f"{prefix}_page", 1) > n_pages:
+        st.session_state[f"{prefix}_page"] = n_pages
+    page = st.number_input("Page", 1, n_pages, key=f"{prefix}_page")
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[positions[start : start + page_size]], hide_index=True)
+    st.caption(
+        f"Page {page} sur {n_pages}, lignes {min(start + 1, len(positions))} à "
+        f"{min(start + page_size, len(positions))} sur {len(positions)}"
+    )
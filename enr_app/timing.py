@@ -0,0 +1,163 @@
+__doc__ = """Mesure du temps passé à chaque étape d'une exécution de page, activée par $ENR_TIMING=1
+
+Les fonctions décorées avec `timed` (chargements, sélections, cartes) et les étapes marquées avec `lap` dans les
+pages sont cumulées par exécution. `timing_panel` écrit le résultat en JSON dans le journal "enr_app.timing" et
+l'affiche dans la barre latérale, avec le taux de succès des caches. Sans $ENR_TIMING, `timed` retourne la
+fonction telle quelle et les autres fonctions ne font rien"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+enabled = os.environ.get("ENR_TIMING", "") not in ("", "0")
+
+logger = logging.getLogger("enr_app.timing")
+if enabled and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Une exécution de page par thread (Streamlit exécute chaque session dans son propre thread)
+_local = threading.local()
+
+
+def start_rerun(page):
+    """
+    Début d'une exécution de page : remet les compteurs à zéro
+
+    Args:
+        page: str, nom de la page
+
+    Returns: None
+    """
+    if not enabled:
+        return
+    _local.page = page
+    _local.start = _local.last = time.perf_counter()
+    _local.stages = {}
+
+
+def _record(name, seconds):
+    stages = getattr(_local, "stages", None)
+    if stages is None:  # hors d'une exécution de page (chargement en arrière-plan)
+        return
+    calls, total = stages.get(name, (0, 0.0))
+    stages[name] = (calls + 1, total + seconds)
+
+
+@contextmanager
+def span(name):
+    """
+    Mesure la durée du bloc, cumulée sous le nom donné
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timed(func):
+    """
+    Décorateur : mesure chaque appel de la fonction (sous son nom), seulement si $ENR_TIMING est définie
+    """
+    if not enabled:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def lap(name):
+    """
+    Enregistre le temps écoulé depuis l'étape précédente (ou le début de l'exécution) sous le nom donné, pour
+    mesurer une partie de page sans la mettre dans un bloc
+
+    Args:
+        name: str, nom de l'étape (par exemple "graphique")
+
+    Returns: None
+    """
+    if not enabled or not hasattr(_local, "last"):
+        return
+    now = time.perf_counter()
+    _record(name, now - _local.last)
+    _local.last = now
+
+
+def cache_stats():
+    """
+    Returns: dict {cache: {"hits", "misses", "size", "maxsize", "bytes"}} pour les caches de rendu et le registre des
+        données
+    """
+    from enr_app.store import render_caches, store
+
+    stats = {name: cache.stats() for name, cache in render_caches.items()}
+    loads = [x["loads"] for x in store.stats().values()]
+    stats["store"] = {"loads": sum(loads), "datasets": len(loads)}
+    return stats
+
+
+def end_rerun():
+    """
+    Fin d'une exécution de page : écrit les durées par étape en JSON dans le journal "enr_app.timing"
+
+    Returns: dict avec page, total (s), stages {étape: {"calls", "seconds"}} et caches, ou None si désactivé
+    """
+    if not enabled or not hasattr(_local, "start"):
+        return None
+    record = {
+        "page": _local.page,
+        "total": round(time.perf_counter() - _local.start, 6),
+        "stages": {
+            name: {"calls": calls, "seconds": round(seconds, 6)}
+            for name, (calls, seconds) in _local.stages.items()
+        },
+        "caches": cache_stats(),
+    }
+    logger.info(json.dumps(record, ensure_ascii=False))
+    return record
+
+
+def timing_panel():
+    """
+    Termine la mesure (voir end_rerun) et affiche les durées par étape et les caches dans la barre latérale.
+    Les durées des fonctions imbriquées sont comprises dans celles des fonctions appelantes
+
+    Returns: None
+    """
+    record = end_rerun()
+    if record is None:
+        return
+    with st.sidebar.expander("Performance", expanded=False):
+        st.write(f"Exécution : {record['total'] * 1000:.0f} ms")
+        stages = pd.DataFrame.from_dict(record["stages"], orient="index")
+        if len(stages):
+            stages["ms"] = (stages.pop("seconds") * 1000).round(1)
+            st.dataframe(stages.sort_values("ms", ascending=False))
+        caches = pd.DataFrame.from_dict(
+            {k: v for k, v in record["caches"].items() if "hits" in v}, orient="index"
+        )
+        if len(caches):
+            requests = caches["hits"] + caches["misses"]
+            caches["taux"] = (caches["hits"] / requests.where(requests > 0)).round(2)
+            st.dataframe(caches)
+        st.caption(
+            f"Données chargées : {record['caches']['store']['loads']} chargements"
+        )
@@ -0,0 +1,126 @@
+__doc__ = """Chargement en parallèle de tous les jeux de données au démarrage du serveur (voir enr_app.serve)
+
+L'état du chargement est écrit dans $ENR_STATUS_FILE pour les sondes Docker / helm, qui le lisent avec
+`python enr_app/status.py` (sans importer pandas ni streamlit)"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from enr_app import map_functions  # noqa: F401, enregistre les contours
+from enr_app.general import indicateurs_engine, indicateurs_pages, load_indicateur
+from enr_app.installations import installations_reader
+from enr_app.reload import start_reloader
+from enr_app.status import status_path
+from enr_app.store import store
+
+_started = threading.Lock()
+_status_lock = threading.Lock()
+_warm_up_names = []
+
+
+# Jeux de données lus par les pages : les autres (table complète des indicateurs, installations biogaz, contours
+# complets) ne sont chargés que s'ils sont nécessaires à ceux-ci
+page_datasets = (
+    "metadata",
+    "zone_tree",
+    "zone_geometries",
+    "contour_regions_simplifiees",
+    "contour_departements_simplifiees",
+    "contour_EPCIs_simplifiees",
+)
+# Lues à la demande, par zone, avec ENR_INSTALLATIONS_READER=gpkg
+installations_datasets = (
+    "index_installations",
+    "bbox_index_installations",
+)
+
+
+def get_tasks():
+    """
+    Returns: dictionnaire {jeu de données: fonction de chargement} à exécuter au démarrage
+    """
+    names = list(page_datasets)
+    if indicateurs_engine == "cube":
+        names.append("cube_indicateurs")
+    if installations_reader != "gpkg":
+        names.extend(installations_datasets)
+    tasks = {name: (lambda name=name: store.get(name)) for name in names}
+    for indicateur in indicateurs_pages:
+        tasks[
+            f"indicateurs[{indicateur}]"
+        ] = lambda indicateur=indicateur: load_indicateur(indicateur)
+    return tasks
+
+
+def warm_up(max_workers=None):
+    """
+    Charge tous les jeux de données en parallèle, sans attendre la fin
+
+    Args:
+        max_workers: int, nombre de threads (default: un par jeu de données)
+
+    Returns: dictionnaire {jeu de données: concurrent.futures.Future}
+    """
+    tasks = get_tasks()
+    _warm_up_names[:] = list(tasks)
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers or len(tasks), thread_name_prefix="warmup"
+    )
+    futures = {name: executor.submit(task) for name, task in tasks.items()}
+    for future in futures.values():
+        future.add_done_callback(lambda _: write_status())
+    executor.shutdown(wait=False)
+    write_status()
+    return futures
+
+
+def start_warm_up():
+    """
+    Lance warm_up une seule fois par processus, puis la vérification des nouvelles versions des données (voir
+    enr_app.reload)
+
+    Returns: bool, True si le chargement a été lancé par cet appel
+    """
+    if not _started.acquire(blocking=False):
+        return False
+    warm_up()
+    store.on_reload(write_status)
+    start_reloader()
+    return True
+
+
+def is_loading(*names):
+    """
+    Args:
+        names: jeux de données
+
+    Returns: bool, True si l'un des jeux de données est encore en cours de chargement (ou en attente)
+    """
+    return any(store.status(name) in ("pending", "loading") for name in names)
+
+
+def get_status():
+    """
+    Returns: dict avec "ready" (bool) et "datasets" (état, nombre et durée des chargements par jeu de données)
+    """
+    stats = store.stats()
+    datasets = {name: stats.get(name, {"status": "pending"}) for name in _warm_up_names}
+    return {
+        "ready": all(x["status"] == "ready" for x in datasets.values()),
+        "datasets": datasets,
+    }
+
+
+def write_status():
+    """
+    Écrit get_status() dans status_path (remplacement atomique du fichier)
+
+    Returns: None
+    """
+    with _status_lock:
+        status_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = status_path.with_name(f"{status_path.name}.tmp")
+        tmp.write_text(json.dumps(get_status(), indent=1), encoding="utf-8")
+        os.replace(tmp, status_path)
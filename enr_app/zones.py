@@ -0,0 +1,154 @@
+__doc__ = """Référentiel des zones : instantané local des régions et départements, et arborescence
+région → département → EPCI pour les menus déroulants
+
+L'instantané (zones.json) est livré avec l'application et versionné. L'API https://geo.api.gouv.fr n'est utilisée
+que pour le mettre à jour : `python -m enr_app.zones`, ou au démarrage si $ENR_ZONES_REFRESH est définie"""
+
+import json
+import os
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+snapshot_path = Path(__file__).parent / "zones.json"
+api_url = "https://geo.api.gouv.fr"
+
+
+def read_snapshot(path=snapshot_path):
+    """
+    Lit l'instantané local du référentiel
+
+    Args:
+        path: chemin du fichier json (default: zones.json livré avec l'application)
+
+    Returns: dict avec "version", "source", "regions" et "departements"
+    """
+    with open(path, encoding="utf-8") as file_in:
+        return json.load(file_in)
+
+
+def fetch_snapshot():
+    """
+    Récupère les régions et départements depuis l'API geo.api.gouv.fr
+
+    Returns: dict avec "version" (date du jour), "source", "regions" et "departements"
+    """
+    regions = pd.read_json(f"{api_url}/regions", dtype=str)
+    departements = pd.read_json(f"{api_url}/departements", dtype=str)
+    return {
+        "version": date.today().isoformat(),
+        "source": api_url,
+        "regions": regions[["nom", "code"]].to_dict("records"),
+        "departements": departements[["nom", "code", "codeRegion"]].to_dict("records"),
+    }
+
+
+def write_snapshot(snapshot, path=snapshot_path):
+    """
+    Écrit l'instantané, un élément par ligne pour garder des diffs lisibles
+
+    Args:
+        snapshot: dict, comme retourné par fetch_snapshot
+        path: chemin du fichier json (default: zones.json livré avec l'application)
+
+    Returns: None
+    """
+
+    def dump_list(key):
+        items = ",\n".join(
+            f"  {json.dumps(x, ensure_ascii=False)}" for x in snapshot[key]
+        )
+        return f' "{key}": [\n{items}\n ]'
+
+    with open(path, "w", encoding="utf-8") as file_out:
+        file_out.write(
+            "{\n"
+            f' "version": {json.dumps(snapshot["version"])},\n'
+            f' "source": {json.dumps(snapshot["source"])},\n'
+            f'{dump_list("regions")},\n'
+            f'{dump_list("departements")}\n'
+            "}\n"
+        )
+
+
+def load_snapshot():
+    """
+    Instantané du référentiel : local par défaut, depuis l'API si $ENR_ZONES_REFRESH est définie et que l'API
+    répond (sinon retour à l'instantané local)
+
+    Returns: tuple (DataFrame régions, DataFrame départements, version)
+    """
+    snapshot = None
+    if os.environ.get("ENR_ZONES_REFRESH"):
+        try:
+            snapshot = fetch_snapshot()
+        except (OSError, ValueError):
+            pass
+    if snapshot is None:
+        snapshot = read_snapshot()
+    return (
+        pd.DataFrame(snapshot["regions"], dtype=str),
+        pd.DataFrame(snapshot["departements"], dtype=str),
+        snapshot["version"],
+    )
+
+
+class ZoneTree:
+    """
+    Arborescence région → département → EPCI, précalculée pour donner chaque liste des menus déroulants
+    sans opération pandas
+    """
+
+    def __init__(self, zones):
+        """
+        Args:
+            zones: DataFrame retourné par load_zones (colonnes TypeZone, Zone, Region, Departement)
+        """
+        by_type = {type_zone: df for type_zone, df in zones.groupby("TypeZone")}
+        self.regions = by_type["Régions"]["Zone"].to_list()
+
+        departements = by_type["Départements"]
+        self._departements = {None: departements["Zone"].to_list()}
+        for region, df in departements.groupby("Region", sort=False):
+            self._departements[region] = df["Zone"].to_list()
+
+        epcis = by_type.get("Epci", zones.iloc[:0])
+        self._epcis = {(None, None): _unique(epcis["Zone"])}
+        for keys, levels in (
+            (["Region"], lambda reg: (reg, None)),
+            (["Departement"], lambda dep: (None, dep)),
+            (["Region", "Departement"], lambda reg, dep: (reg, dep)),
+        ):
+            for key, df in epcis.groupby(keys, sort=False):
+                key = key if isinstance(key, tuple) else (key,)
+                self._epcis[levels(*key)] = _unique(df["Zone"])
+
+    def departements(self, region=None):
+        """
+        Args:
+            region: str ou None (toutes)
+
+        Returns: liste des départements de la région
+        """
+        return self._departements.get(region, [])
+
+    def epcis(self, region=None, departement=None):
+        """
+        Args:
+            region: str ou None (toutes)
+            departement: str ou None (tous)
+
+        Returns: liste des EPCIs de la région et du département, tous les EPCIs si la combinaison n'existe pas
+        """
+        return self._epcis.get((region, departement), self._epcis[(None, None)])
+
+
+def _unique(series):
+    return list(dict.fromkeys(series))
+
+
+if __name__ == "__main__":
+    snapshot = fetch_snapshot()
+    write_snapshot(snapshot)
+    print(f"{snapshot_path}: version {snapshot['version']}")
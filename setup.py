@@ -36,7 +36,8 @@ if __name__ == "__main__":
             "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
             "Operating System :: OS Independent",
         ],
-        python_requires=">=3.8",
+        python_requires=">=3.10",
         install_requires=requirements,
         include_package_data=True,
+        package_data={PKG_NAME: ["zones.json"]},
     )